@@ -1,3 +1,4 @@
+from database import get_player_stats
 
 ACHIEVEMENTS = {
     1: {
@@ -30,7 +31,7 @@ ACHIEVEMENTS = {
 }
 
 def check_achievements(player_id):
-    stats = game_data["player_stats"].get(str(player_id), {})
+    stats = get_player_stats(player_id)
     achievements = stats.get("achievements", [])
     new_achievements = []
     
@@ -42,3 +43,10 @@ def check_achievements(player_id):
         new_achievements.append("mafia_master")
         
     return new_achievements
+
+def get_achievement(achievement_id):
+    """Look up an achievement by its id ("first_win", "rich_player"...)"""
+    for key, achievement in ACHIEVEMENTS.items():
+        if key == achievement_id or achievement.get("id") == achievement_id:
+            return achievement
+    return {}
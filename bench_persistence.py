@@ -0,0 +1,327 @@
+"""
+Persistence Benchmarks
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+
+Measures the database.py API against throwaway files, and how late the
+event loop runs while saving with writes inline vs on the worker thread
+(loop_lag_*):
+
+    python bench_persistence.py --json report.json
+    python bench_persistence.py --users 1000,10000 --rooms 10 --csv report.csv
+    python bench_persistence.py --compare baseline.json --threshold 0.2
+
+Every benchmark runs --repeat times and reports the median; ``spread`` is
+how far the runs were apart ((max - min) / median of p50 or throughput,
+whichever is larger). --compare exits with status 1 when any benchmark's
+p50 got slower than the baseline (or throughput dropped) by more than the
+threshold, widened to twice the spread of either report so run-to-run
+noise is not flagged.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import database
+from journal import GameJournal
+from storage import SQLiteUserStore
+
+DEFAULT_USERS = "1000,10000,100000,1000000"
+DEFAULT_ROOMS = "10,100,1000"
+PLAYERS_PER_ROOM = 8
+FIELDS = ["benchmark", "users", "rooms", "ops", "mean_us", "p50_us", "p95_us", "p99_us", "max_us", "ops_per_sec",
+          "spread"]
+METRIC_FIELDS = FIELDS[3:-1]
+
+
+def configure(workdir: str):
+    """Point database.py at fresh files in ``workdir`` and drop all cached state"""
+    database.USER_STORE_FILE = os.path.join(workdir, "user_database.sqlite3")
+    database.USER_DB_FILE = os.path.join(workdir, "user_database.json")
+    database.TEMP_DB_FILE = os.path.join(workdir, "temp_game_data.snap")
+    database.LEGACY_TEMP_DB_FILE = os.path.join(workdir, "temp_game_data.json")
+    database.journal.close()
+    database.journal = GameJournal(os.path.join(workdir, "temp_game_data.journal"))
+    if database._user_store is not None:
+        database._user_store.close()
+    database.set_user_store(None)
+    database.profiles.clear()
+
+
+def populate_users(count: int, batch: int = 50000):
+    """Write ``count`` users straight into the SQLite file"""
+    store = SQLiteUserStore(database.USER_STORE_FILE)
+    rows = {}
+    for user_id in range(1, count + 1):
+        stats = dict(database.DEFAULT_USER_STATS)
+        stats.update(points=random.randint(0, 50000), wins=random.randint(0, 200),
+                     games_played=random.randint(0, 500), level=random.randint(1, 30))
+        rows[user_id] = stats
+        if len(rows) >= batch:
+            store.put_many(rows)
+            rows = {}
+    if rows:
+        store.put_many(rows)
+    store.close()
+
+
+def make_game_data(rooms: int) -> Dict:
+    """A game_data dict shaped like a busy bot with ``rooms`` active rooms"""
+    active_rooms = {}
+    for room_id in range(10000, 10000 + rooms):
+        players = [{"id": room_id * 100 + i, "name": f"Player {i}", "role": "Villager",
+                    "is_alive": True, "is_bot": False} for i in range(PLAYERS_PER_ROOM)]
+        active_rooms[str(room_id)] = {
+            "creator_id": players[0]["id"], "chat_id": -room_id, "mode": "classic",
+            "phase": "night", "players": players, "bot_count": 0,
+            "votes": {str(p["id"]): players[0]["id"] for p in players}, "created_at": time.time()
+        }
+    return {"active_rooms": active_rooms, "current_games": {}, "player_stats": {},
+            "waiting_for_roles": set(), "protected_players": set(), "used_actions": set()}
+
+
+def measure(name: str, fn: Callable[[int], None], ops: int, users: int, rooms: int,
+            drain: bool = False) -> Dict:
+    """Time ``ops`` calls of ``fn(i)``; with ``drain`` throughput includes the queued writes"""
+    samples = []
+    started = time.perf_counter()
+    for i in range(ops):
+        t0 = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - t0)
+    if drain:
+        asyncio.run(database.worker.barrier())
+    return summarize(name, samples, time.perf_counter() - started, users, rooms)
+
+
+def summarize(name: str, samples: List[float], elapsed: float, users: int, rooms: int) -> Dict:
+    """Report row for ``samples`` (seconds) taken over ``elapsed`` seconds"""
+    ops = len(samples)
+    samples.sort()
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))] * 1e6
+
+    return {
+        "benchmark": name,
+        "users": users,
+        "rooms": rooms,
+        "ops": ops,
+        "mean_us": round(statistics.fmean(samples) * 1e6, 2),
+        "p50_us": round(pct(0.50), 2),
+        "p95_us": round(pct(0.95), 2),
+        "p99_us": round(pct(0.99), 2),
+        "max_us": round(samples[-1] * 1e6, 2),
+        "ops_per_sec": round(ops / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def bench_users(users: int, ops: int, workdir: str) -> List[Dict]:
+    configure(workdir)
+    populate_users(users)
+    ids = [random.randint(1, users) for _ in range(ops)]
+    results = []
+
+    database.profiles.clear()
+    results.append(measure("get_user_stats_cold", lambda i: database.get_user_stats(ids[i]), ops, users, 0))
+    results.append(measure("get_user_stats_warm", lambda i: database.get_user_stats(ids[i]), ops, users, 0))
+    results.append(measure("update_user_stats",
+                           lambda i: database.update_user_stats(ids[i], {"wins": i}),
+                           ops, users, 0, drain=True))
+    results.append(measure("add_exp", lambda i: database.add_exp(ids[i], 150), ops, users, 0, drain=True))
+    return results
+
+
+def bench_rooms(rooms: int, ops: int, workdir: str) -> List[Dict]:
+    configure(workdir)
+    data = make_game_data(rooms)
+    room_ids = list(data["active_rooms"])
+    results = []
+
+    def save_room(i):
+        room = data["active_rooms"][room_ids[i % rooms]]
+        room["votes"][str(room["players"][i % PLAYERS_PER_ROOM]["id"])] = i
+        database.save_database(data, room_id=room_ids[i % rooms])
+        database.write_cache.flush()
+
+    def save_full(i):
+        data["current_games"]["bench"] = i
+        database.save_database(data)
+        database.write_cache.flush()
+
+    save_full(0)
+    results.append(measure("save_database_room", save_room, ops, 0, rooms, drain=True))
+    results.append(measure("save_database_full", save_full, max(1, ops // 10), 0, rooms, drain=True))
+
+    asyncio.run(database.worker.barrier())
+    results.append(measure("load_database", lambda i: database.load_database({}), max(1, ops // 10), 0, rooms))
+
+    # Event loop lateness while handlers save, with the writes inline (as
+    # before the persistence worker) and on the worker thread
+    database.worker.stop()
+    results.append(asyncio.run(loop_lag("loop_lag_inline", data, room_ids, ops)))
+    database.worker.start()
+    results.append(asyncio.run(loop_lag("loop_lag_worker", data, room_ids, ops)))
+    return results
+
+
+async def loop_lag(name: str, data: Dict, room_ids: List[str], ops: int, tick: float = 0.001) -> Dict:
+    """Lateness of a ``tick`` sleep while ``ops`` room saves run on the same loop"""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            before = loop.time()
+            await asyncio.sleep(tick)
+            lags.append(max(0.0, loop.time() - before - tick))
+
+    task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    for i in range(ops):
+        room_id = room_ids[i % len(room_ids)]
+        database.record("room_updated", room_id, save=False, fields={"bench": i})
+        database.save_database(data, room_id=room_id)
+        database.write_cache.flush()
+        await asyncio.sleep(0)
+    await database.worker.barrier()
+    elapsed = time.perf_counter() - started
+    done.set()
+    await task
+    return summarize(name, lags or [0.0], elapsed, 0, len(room_ids))
+
+
+def combine(runs: List[List[Dict]]) -> List[Dict]:
+    """Median of each benchmark over repeated runs, plus their spread"""
+    grouped: Dict[tuple, List[Dict]] = {}
+    for results in runs:
+        for row in results:
+            grouped.setdefault((row["benchmark"], row["users"], row["rooms"]), []).append(row)
+
+    combined = []
+    for (name, users, rooms), rows in grouped.items():
+        row = {"benchmark": name, "users": users, "rooms": rooms}
+        for field in METRIC_FIELDS:
+            # Round like summarize(); an even --repeat averages the middle two
+            row[field] = round(statistics.median(r[field] for r in rows), 2)
+
+        def spread(field):
+            values = [r[field] for r in rows]
+            median = statistics.median(values)
+            return (max(values) - min(values)) / median if median else 0.0
+
+        row["spread"] = round(max(spread("p50_us"), spread("ops_per_sec")), 3)
+        combined.append(row)
+    return combined
+
+
+def write_reports(results: List[Dict], json_path: str = None, csv_path: str = None):
+    if json_path:
+        report = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "results": results,
+        }
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    if csv_path:
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def compare(results: List[Dict], baseline_path: str, threshold: float) -> bool:
+    """Print a side-by-side comparison; returns False if anything regressed"""
+    with open(baseline_path, 'r') as f:
+        baseline = {(r["benchmark"], r["users"], r["rooms"]): r for r in json.load(f)["results"]}
+
+    ok = True
+    print(f"\n{'benchmark':<24}{'users':>9}{'rooms':>7}{'base p50':>12}{'p50':>12}{'change':>9}{'allowed':>9}")
+    for row in results:
+        base = baseline.get((row["benchmark"], row["users"], row["rooms"]))
+        if base is None:
+            print(f"{row['benchmark']:<24}{row['users']:>9}{row['rooms']:>7}{'-':>12}{row['p50_us']:>12.2f}{'new':>9}")
+            continue
+        change = row["p50_us"] / base["p50_us"] - 1 if base["p50_us"] else 0.0
+        throughput_drop = 1 - row["ops_per_sec"] / base["ops_per_sec"] if base["ops_per_sec"] else 0.0
+        allowed = max(threshold, 2 * base.get("spread", 0.0), 2 * row["spread"])
+        regressed = change > allowed or throughput_drop > allowed
+        ok = ok and not regressed
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{row['benchmark']:<24}{row['users']:>9}{row['rooms']:>7}"
+              f"{base['p50_us']:>12.2f}{row['p50_us']:>12.2f}{change:>+8.0%}{allowed:>9.0%}{flag}")
+    return ok
+
+
+def print_results(results: List[Dict]):
+    print(f"{'benchmark':<24}{'users':>9}{'rooms':>7}{'p50 us':>10}{'p99 us':>10}{'ops/s':>12}{'spread':>8}")
+    for row in results:
+        print(f"{row['benchmark']:<24}{row['users']:>9}{row['rooms']:>7}"
+              f"{row['p50_us']:>10.2f}{row['p99_us']:>10.2f}{row['ops_per_sec']:>12.2f}{row['spread']:>8.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark database.py persistence")
+    parser.add_argument("--users", default=DEFAULT_USERS, help="comma-separated user counts")
+    parser.add_argument("--rooms", default=DEFAULT_ROOMS, help="comma-separated active room counts")
+    parser.add_argument("--ops", type=int, default=1000, help="operations per benchmark")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--json", dest="json_path", help="write a JSON report (usable as a baseline)")
+    parser.add_argument("--csv", dest="csv_path", help="write a CSV report")
+    parser.add_argument("--compare", dest="baseline", help="JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="allowed slowdown before --compare fails (0.10 = 10%%), "
+                             "widened to twice the measured spread")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark; the median is reported")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary files")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="mafia-bench-")
+    database.start_persistence()
+    runs = []
+    try:
+        for run in range(max(1, args.repeat)):
+            results = []
+            for users in (int(n) for n in args.users.split(",") if n):
+                print(f"run {run + 1}: users={users}...", file=sys.stderr)
+                path = os.path.join(workdir, f"run{run}", f"users-{users}")
+                os.makedirs(path)
+                results.extend(bench_users(users, args.ops, path))
+            for rooms in (int(n) for n in args.rooms.split(",") if n):
+                print(f"run {run + 1}: rooms={rooms}...", file=sys.stderr)
+                path = os.path.join(workdir, f"run{run}", f"rooms-{rooms}")
+                os.makedirs(path)
+                results.extend(bench_rooms(rooms, args.ops, path))
+            runs.append(results)
+    finally:
+        database.flush()
+        configure(workdir)
+        if args.keep:
+            print(f"Files kept in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = combine(runs)
+    print_results(results)
+    write_reports(results, args.json_path, args.csv_path)
+    if args.baseline and not compare(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
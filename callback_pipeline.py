@@ -0,0 +1,139 @@
+"""
+Callback Query Pipeline
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import asyncio
+import logging
+from typing import Callable, Optional
+
+
+class DeferredCallbackQuery:
+    """Stands in for a CallbackQuery while its handler runs in the background.
+
+    Everything is forwarded to the real query except answer(): a query
+    can only be answered once, and the pipeline may already have done so
+    to stop the button spinner. A late alert is then sent as a message
+    instead (see CallbackPipeline); a late toast is dropped.
+    """
+
+    def __init__(self, query, pipeline: "CallbackPipeline"):
+        self._query = query
+        self._pipeline = pipeline
+        self._answered = asyncio.Event()
+        self._acknowledged = False
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+    @property
+    def answered(self) -> bool:
+        return self._answered.is_set()
+
+    async def answer(self, text: Optional[str] = None, show_alert: bool = False, **kwargs):
+        if self._acknowledged or self._answered.is_set():
+            if text and show_alert:
+                return await self._pipeline.follow_up(self._query, text)
+            if text:
+                self._pipeline.dropped += 1
+            return True
+        self._answered.set()
+        return await self._query.answer(text=text, show_alert=show_alert, **kwargs)
+
+    async def acknowledge(self):
+        """Answer with nothing, unless the handler already answered"""
+        if self._answered.is_set():
+            return
+        self._answered.set()
+        self._acknowledged = True
+        try:
+            await self._query.answer()
+        except Exception as e:
+            print(f"Error acknowledging callback: {e}")
+
+
+class _UpdateProxy:
+    """The update as the handler sees it: callback_query is the deferred one"""
+
+    def __init__(self, update, query: DeferredCallbackQuery):
+        self._update = update
+        self.callback_query = query
+
+    def __getattr__(self, name):
+        return getattr(self._update, name)
+
+
+class CallbackPipeline:
+    """Answers every callback query within ``budget`` seconds.
+
+    wrap(handler) gives a CallbackQueryHandler callback that starts the
+    handler as a background task and waits at most ``budget`` seconds
+    for it to answer the query. If it has not by then (or it finished
+    without answering) the query is answered empty so the spinner stops,
+    and the handler keeps running. A show_alert answer that comes later
+    is sent to the user privately, or as a reply in the chat if the bot
+    cannot message them.
+    """
+
+    def __init__(self, budget: float = 0.5):
+        self.budget = budget
+        self._tasks = set()
+        self.acknowledged = 0
+        self.followups = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def wrap(self, handler: Callable):
+        async def run(update, context):
+            query = update.callback_query
+            if query is None:
+                return await handler(update, context)
+
+            deferred = DeferredCallbackQuery(query, self)
+            task = asyncio.get_running_loop().create_task(handler(_UpdateProxy(update, deferred), context))
+            self._tasks.add(task)
+            task.add_done_callback(self._task_done)
+
+            answered = asyncio.get_running_loop().create_task(deferred._answered.wait())
+            try:
+                await asyncio.wait({task, answered}, timeout=self.budget, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                answered.cancel()
+            if not deferred.answered:
+                self.acknowledged += 1
+                await deferred.acknowledge()
+        return run
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Error in callback handler: {task.exception()}")
+
+    async def follow_up(self, query, text: str):
+        """Deliver an alert that came too late to be a query answer"""
+        self.followups += 1
+        bot = query.get_bot()
+        user = query.from_user
+        try:
+            return await bot.send_message(chat_id=user.id, text=text)
+        except Exception:
+            pass
+        if query.message is not None:
+            try:
+                mention = f"@{user.username}" if user.username else user.first_name
+                return await query.message.reply_text(f"{mention}: {text}")
+            except Exception as e:
+                print(f"Error sending callback follow-up: {e}")
+        return None
+
+    async def shutdown(self, timeout: float = 5.0):
+        """Give running handlers ``timeout`` seconds, then cancel them"""
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
@@ -1,63 +1,83 @@
-import json
 import os
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from storage import UserStore, JSONUserStore, SQLiteUserStore, SQLiteCounterStore, QueuedUserStore, migrate_json_users
+from persistence import WriteBehindCache, PersistenceWorker
+from journal import GameJournal, apply_operation, write_atomic, SEQ_KEY
+from leaderboard import Leaderboard
+from profiles import PlayerProfile, ProfileCache
+import snapshot_codec
 
-# Permanent user data file
+# Permanent user data backend ("sqlite" or "json")
+USER_DB_BACKEND = "sqlite"
+# Permanent user data file (SQLite)
+USER_STORE_FILE = "user_database.sqlite3"
+# Legacy user data file, imported into the SQLite store on first start
 USER_DB_FILE = "user_database.json"
-# Temporary game data file
-TEMP_DB_FILE = "temp_game_data.json"
-
-# Default user stats structure
-DEFAULT_USER_STATS = {
-    "points": 0,
-    "level": 1,
-    "exp": 0,
-    "games_played": 0,
-    "wins": 0,
-    "achievements": [],
-    "items": {},
-    "balance": 1000
-}
-
-def load_user_data() -> Dict:
-    try:
-        if os.path.exists(USER_DB_FILE):
-            with open(USER_DB_FILE, 'r') as f:
-                return json.load(f)
-        return {"users": {}}
-    except Exception as e:
-        logging.error(f"Error loading user database: {e}")
-        return {"users": {}}
+# Temporary game data file (compacted snapshot, see snapshot_codec)
+TEMP_DB_FILE = "temp_game_data.snap"
+# Old pretty-JSON temp file, read once and upgraded if no snapshot exists
+LEGACY_TEMP_DB_FILE = "temp_game_data.json"
+# Operations recorded since the last snapshot
+JOURNAL_FILE = "temp_game_data.journal"
 
-def save_user_data(data: Dict):
-    try:
-        with open(USER_DB_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-    except Exception as e:
-        logging.error(f"Error saving user database: {e}")
+# Default user stats structure (see profiles.PlayerProfile)
+DEFAULT_USER_STATS = PlayerProfile().to_dict()
+
+# Runs all writes below on a background thread once start_persistence() is called
+worker = PersistenceWorker(high_water=10000)
+
+_user_store: Optional[UserStore] = None
+
+def get_user_store() -> UserStore:
+    """Return the active user store, opening it (and migrating the JSON file) on first use"""
+    global _user_store
+    if _user_store is None:
+        if USER_DB_BACKEND == "sqlite":
+            store = SQLiteUserStore(USER_STORE_FILE)
+            migrate_json_users(USER_DB_FILE, store)
+        else:
+            store = JSONUserStore(USER_DB_FILE)
+        _user_store = QueuedUserStore(store, worker.submit)
+    return _user_store
+
+def set_user_store(store: UserStore):
+    """Swap the user storage backend (e.g. for a different database)"""
+    global _user_store
+    _user_store = store
+
+_counter_store: Optional[SQLiteCounterStore] = None
+
+def get_counter_store() -> SQLiteCounterStore:
+    """Counters shared by every process using USER_STORE_FILE (room ids)"""
+    global _counter_store
+    if _counter_store is None:
+        _counter_store = SQLiteCounterStore(USER_STORE_FILE)
+    return _counter_store
+
+# Rankings by points/wins/level, rebuilt from the user store on first use
+leaderboard = Leaderboard(lambda: get_user_store().iter_users())
 
-def get_user_stats(user_id: int) -> Dict:
-    user_data = load_user_data()
-    user_id_str = str(user_id)
-    if user_id_str not in user_data["users"]:
-        user_data["users"][user_id_str] = DEFAULT_USER_STATS.copy()
-        save_user_data(user_data)
-    return user_data["users"][user_id_str]
+# The one place player data is read from and written through
+profiles = ProfileCache(get_user_store, on_save=leaderboard.update)
+
+def get_user_stats(user_id: int, username: Optional[str] = None) -> PlayerProfile:
+    return profiles.get(user_id, username)
 
 def update_user_stats(user_id: int, updates: Dict):
-    user_data = load_user_data()
-    user_id_str = str(user_id)
-    if user_id_str not in user_data["users"]:
-        user_data["users"][user_id_str] = DEFAULT_USER_STATS.copy()
-    user_data["users"][user_id_str].update(updates)
-    save_user_data(user_data)
+    profiles.get(user_id).update(updates)
+    profiles.save(user_id)
+
+def save_profile(user_id: int):
+    """Persist changes made to a profile returned by get_user_stats/get_player_stats"""
+    profiles.save(user_id)
 
 def get_temp_game_data() -> Dict:
     try:
-        if os.path.exists(TEMP_DB_FILE):
-            with open(TEMP_DB_FILE, 'r') as f:
-                return json.load(f)
+        for path in (TEMP_DB_FILE, LEGACY_TEMP_DB_FILE):
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    return snapshot_codec.decode(f.read())
         return {"active_rooms": {}, "current_games": {}}
     except Exception as e:
         logging.error(f"Error loading temp game data: {e}")
@@ -65,67 +85,143 @@ def get_temp_game_data() -> Dict:
 
 def save_temp_game_data(data: Dict):
     try:
-        with open(TEMP_DB_FILE, 'w') as f:
-            json.dump(data, f)
+        write_atomic(TEMP_DB_FILE, snapshot_codec.encode(data))
     except Exception as e:
         logging.error(f"Error saving temp game data: {e}")
 
-def add_exp(user_id: int, exp_amount: int):
-    user_stats = get_user_stats(user_id)
-    user_stats["exp"] += exp_amount
+def _apply_exp(profile: PlayerProfile, exp_amount: int) -> bool:
+    """Add exp in place; returns True when the player levelled up"""
+    profile.exp += exp_amount
 
     # Level up logic
-    level_threshold = user_stats["level"] * 1000
-    if user_stats["exp"] >= level_threshold:
-        user_stats["level"] += 1
-        user_stats["exp"] -= level_threshold
-        user_stats["points"] += 500  # Level up bonus
+    level_threshold = profile.level * 1000
+    if profile.exp >= level_threshold:
+        profile.level += 1
+        profile.exp -= level_threshold
+        profile.points += 500  # Level up bonus
+        return True
+    return False
 
-    update_user_stats(user_id, user_stats)
+def add_exp(user_id: int, exp_amount: int):
+    _apply_exp(profiles.get(user_id), exp_amount)
+    profiles.save(user_id)
 
 game_data: Dict[str, Any] = {}
 
 
+journal = GameJournal(JOURNAL_FILE)
+
+def use_shard(shard: int):
+    """Keep this process's temporary game data in files of its own.
+
+    For sharding.py workers, which each own part of the rooms; call it
+    before load_database(). User data and counters stay shared (SQLite);
+    a player can be in rooms of several workers at once, so profile
+    writes become additive instead of replacing the whole row.
+    """
+    global TEMP_DB_FILE, LEGACY_TEMP_DB_FILE, JOURNAL_FILE, journal
+    profiles.additive = True
+    TEMP_DB_FILE = f"temp_game_data.shard{shard}.snap"
+    LEGACY_TEMP_DB_FILE = f"temp_game_data.shard{shard}.json"
+    JOURNAL_FILE = f"temp_game_data.shard{shard}.journal"
+    journal.close()
+    journal = GameJournal(JOURNAL_FILE)
+
+def _write_temp_snapshot(blob: bytes):
+    try:
+        # Runs on the worker after every journal append queued before it,
+        # so the snapshot covers the journal up to this position
+        journal_position = journal.position()
+        write_atomic(TEMP_DB_FILE, blob)
+        journal.compact(journal_position)
+    except Exception as e:
+        logging.error(f"Error saving temp game data: {e}")
+
+# Coalesces save_database() calls; at most one snapshot write per interval
+write_cache = WriteBehindCache(lambda blob: worker.submit(_write_temp_snapshot, blob, key="snapshot"),
+                               interval=1.0, max_dirty=256)
+
 def load_database(data):
+    global game_data
     try:
-        game_data.update(get_temp_game_data())
+        data.update(get_temp_game_data())
+        replayed = journal.replay(data)
+        if replayed:
+            logging.info(f"Replayed {replayed} journaled operations")
+        _migrate_player_stats(data)
+        # Share one dict with the caller so helpers below see the loaded state
+        game_data = data
     except Exception as e:
         logging.error(f"Error loading database: {e}")
 
-def save_database(data):
+def record(op: str, room_id, save: bool = True, **fields):
+    """Apply a room operation to game_data and append it to the journal.
+
+    Operations: room_created, player_joined, player_left, role_assigned,
+    vote_cast, player_died, room_updated, room_deleted. Pass ``save=False``
+    when recording a batch and call save_database(room_ids=...) once after.
+    """
     try:
-        data_to_save = data.copy()
+        entry = journal.make_entry(op, room_id=room_id, **fields)
+        worker.submit(journal.write_entry, entry)
+        apply_operation(game_data, entry)
+        if save:
+            save_database(game_data, keys=[SEQ_KEY], room_id=room_id)
+    except Exception as e:
+        logging.error(f"Error recording {op}: {e}")
 
-        # Convert sets to lists for JSON serialization
-        if "waiting_for_roles" in data_to_save:
-            data_to_save["waiting_for_roles"] = list(data_to_save["waiting_for_roles"])
-        if "protected_players" in data_to_save:
-            data_to_save["protected_players"] = list(data_to_save["protected_players"])
-        if "used_actions" in data_to_save:
-            data_to_save["used_actions"] = list(data_to_save["used_actions"])
+def save_database(data, keys=None, room_id=None, player_id=None, player_ids=None, room_ids=None):
+    """Mark game data as changed; the write happens in the background.
 
-        save_temp_game_data(data_to_save)
+    Pass ``keys``, ``room_id(s)`` or ``player_id(s)`` to say what changed, so
+    only those parts are re-encoded. Without hints the whole dict is.
+    """
+    try:
+        write_cache.mark_dirty(data, keys=keys, room_id=room_id, player_id=player_id,
+                               player_ids=player_ids, room_ids=room_ids)
     except Exception as e:
         logging.error(f"Error saving database: {e}")
 
+def flush():
+    """Write any pending game data now (call on shutdown)"""
+    write_cache.flush()
+    worker.stop()
+
+async def flush_durable():
+    """Flush pending game data and wait until it is on disk.
+
+    Use after writes that must not be lost (purchases, payouts); other
+    saves are fire-and-forget.
+    """
+    write_cache.flush()
+    await worker.barrier()
+
+def start_persistence():
+    """Move persistence I/O to the background worker thread"""
+    worker.start()
+
+def _migrate_player_stats(data: Dict):
+    """Fold the old game_data["player_stats"] map into the player profiles"""
+    old_stats = data.get("player_stats")
+    if not old_stats:
+        return
+    for player_id, stats in old_stats.items():
+        profiles.get(player_id).merge(stats)
+    profiles.save_many(int(player_id) for player_id in old_stats)
+    logging.info(f"Migrated {len(old_stats)} player stats into profiles")
+    data["player_stats"] = {}
+    save_database(data, keys=["player_stats"])
+
 def update_player_points(player_id: int, points: int):
     try:
-        player_id_str = str(player_id)
-        if player_id_str not in game_data["player_stats"]:
-            game_data["player_stats"][player_id_str] = {
-                "points": 0,
-                "games": 0,
-                "wins": 0,
-                "items": {}
-            }
-        game_data["player_stats"][player_id_str]["points"] += points
-        save_database(game_data)
+        profiles.get(player_id).points += points
+        profiles.save(player_id)
     except Exception as e:
         logging.error(f"Error updating player points: {e}")
 
 def get_player_points(player_id: int) -> int:
     try:
-        return game_data["player_stats"].get(str(player_id), {}).get("points", 0)
+        return profiles.get(player_id).points
     except Exception as e:
         logging.error(f"Error getting player points: {e}")
         return 0
@@ -137,18 +233,63 @@ def can_afford_item(player_id: int, item_price: int) -> bool:
         logging.error(f"Error checking if player can afford item: {e}")
         return False
 
-def get_player_stats(player_id: int) -> dict:
-    try:
-        player_id_str = str(player_id)
-        if player_id_str not in game_data["player_stats"]:
-            game_data["player_stats"][player_id_str] = {
-                "points": 0,
-                "games": 0,
-                "wins": 0,
-                "items": {},
-                "achievements": []
-            }
-        return game_data["player_stats"][player_id_str]
-    except Exception as e:
-        logging.error(f"Error getting player stats: {e}")
-        return {"points": 0, "games": 0, "wins": 0, "items": {}, "achievements": []}
\ No newline at end of file
+def get_player_stats(player_id: int, username: Optional[str] = None) -> PlayerProfile:
+    """Same profile as get_user_stats; kept for the game and shop handlers"""
+    return profiles.get(player_id, username)
+
+# Roles whose wins count towards the Mafia Master achievement
+MAFIA_ROLES = ("Mafia", "Boss Mafia")
+
+async def settle_game(results: List[Dict]) -> List[Dict]:
+    """Apply end-of-game stats for every player of a room in one batch.
+
+    ``results`` holds one dict per player: ``player_id``, ``won`` and
+    optionally ``name``, ``role``, ``exp`` and ``points``. Bots (negative ids)
+    are skipped. All profiles are written in one store transaction and the
+    call returns once it is on disk.
+
+    Returns events to announce, e.g.
+    ``{"player_id": 1, "type": "level_up", "level": 3}`` or
+    ``{"player_id": 1, "type": "achievement", "achievement": "first_win", ...}``.
+    """
+    from achievements import check_achievements, get_achievement
+
+    events = []
+    settled = {}
+
+    for result in results:
+        player_id = result["player_id"]
+        if player_id < 0:
+            continue
+        won = bool(result.get("won"))
+
+        profile = profiles.get(player_id, result.get("name"))
+        profile.games_played += 1
+        profile.points += result.get("points", 0)
+        if won:
+            profile.wins += 1
+            if result.get("role") in MAFIA_ROLES:
+                profile.mafia_wins += 1
+        if _apply_exp(profile, result.get("exp", 0)):
+            events.append({"player_id": player_id, "type": "level_up", "level": profile.level})
+
+        for achievement_id in check_achievements(player_id):
+            achievement = get_achievement(achievement_id)
+            reward = achievement.get("reward", 0)
+            profile.achievements.append(achievement_id)
+            profile.points += reward
+            events.append({
+                "player_id": player_id,
+                "type": "achievement",
+                "achievement": achievement_id,
+                "name": achievement.get("name", achievement_id),
+                "reward": reward
+            })
+
+        settled[player_id] = profile
+
+    if settled:
+        # Written from the objects held here, even if the cache dropped some meanwhile
+        profiles.write(settled)
+        await flush_durable()
+    return events
@@ -16,7 +16,7 @@ async def handle_day_phase(room, context, day_number):
         )
 
         # Display alive players
-        alive_players = [p for p in room.players if p["is_alive"]]
+        alive_players = room.get_alive_players()
         player_list = "\n".join([
             f"{'🤖 ' if p.get('is_bot') else '👤 '}{p['name']}"
             for p in alive_players
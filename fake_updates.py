@@ -0,0 +1,99 @@
+"""
+Fake Update Sender
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+
+Posts synthetic Telegram updates to a webhook, for trying webhook mode
+locally:
+
+    python main.py --webhook --port 8443 --secret test --self-signed 127.0.0.1
+    python fake_updates.py https://127.0.0.1:8443/telegram --secret test --insecure
+"""
+
+import argparse
+import asyncio
+import itertools
+import ssl
+import time
+from collections import Counter
+import aiohttp
+
+
+def fake_update(update_id: int, user_id: int, chat_id: int, kind: str) -> dict:
+    """A minimal Update as Telegram sends it: a /start message or a button press"""
+    now = int(time.time())
+    user = {"id": user_id, "is_bot": False, "first_name": f"Tester{user_id}", "username": f"tester{user_id}"}
+    chat = {"id": chat_id, "type": "private" if chat_id == user_id else "supergroup"}
+    message = {"message_id": update_id, "date": now, "chat": chat, "from": user, "text": "/start",
+               "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}
+    if kind == "message":
+        return {"update_id": update_id, "message": message}
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": user, "chat_instance": str(chat_id),
+        "message": message, "data": "main_menu"
+    }}
+
+
+async def send(url: str, secret: str, count: int, concurrency: int, users: int, chat_id: int,
+               kinds, insecure: bool = False):
+    ssl_context = None
+    if url.startswith("https") and insecure:
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+    statuses = Counter()
+    latencies = []
+    update_ids = itertools.count(1)
+    kinds = itertools.cycle(kinds)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(session, update):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": secret},
+                                        ssl=ssl_context) as response:
+                    statuses[response.status] += 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        updates = []
+        for i in range(count):
+            update_id = next(update_ids)
+            user_id = 100000 + i % users
+            updates.append(fake_update(update_id, user_id, chat_id or user_id, next(kinds)))
+        await asyncio.gather(*(post(session, update) for update in updates))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Sent {count} updates in {elapsed:.2f}s ({count / elapsed:.0f}/s)")
+    print("Status: " + ", ".join(f"{status}={n}" for status, n in sorted(statuses.items(), key=str)))
+    if latencies:
+        print(f"Latency: p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+              f"p99={latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms max={latencies[-1] * 1000:.1f}ms")
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post fake Telegram updates to a webhook")
+    parser.add_argument("url", help="Webhook URL, e.g. https://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", required=True, help="Secret token the webhook expects")
+    parser.add_argument("--count", type=int, default=100, help="Updates to send")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requests in flight at once")
+    parser.add_argument("--users", type=int, default=10, help="Distinct fake users")
+    parser.add_argument("--chat", type=int, default=0, help="Group chat id; private chats when omitted")
+    parser.add_argument("--kind", choices=("message", "callback", "mixed"), default="mixed")
+    parser.add_argument("--insecure", action="store_true", help="Accept a self-signed certificate")
+    args = parser.parse_args()
+
+    kinds = ("message", "callback") if args.kind == "mixed" else (args.kind,)
+    asyncio.run(send(args.url, args.secret, args.count, args.concurrency, args.users, args.chat,
+                     kinds, insecure=args.insecure))
+
+
+if __name__ == "__main__":
+    main()
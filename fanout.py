@@ -0,0 +1,73 @@
+"""
+Private Message Fan-out
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from telegram.error import BadRequest, Forbidden
+
+# PMs in flight per batch; the outbox still applies the Bot API limits
+DEFAULT_CONCURRENCY = 10
+
+
+@dataclass
+class Delivery:
+    """Outcome of one private message"""
+    user_id: int
+    ok: bool
+    message: Any = None
+    error: Optional[str] = None
+    # The user blocked the bot or never started a chat with it
+    blocked: bool = False
+
+
+async def _deliver(bot, semaphore, user_id, kwargs) -> Delivery:
+    async with semaphore:
+        try:
+            return Delivery(user_id, True, message=await bot.send_message(chat_id=user_id, **kwargs))
+        except Forbidden as e:
+            return Delivery(user_id, False, error=str(e), blocked=True)
+        except BadRequest as e:
+            return Delivery(user_id, False, error=str(e), blocked="chat not found" in str(e).lower())
+        except Exception as e:
+            return Delivery(user_id, False, error=str(e))
+
+
+async def fan_out(bot, messages: Dict[int, Dict], concurrency: int = DEFAULT_CONCURRENCY) -> Dict[int, Delivery]:
+    """Send private messages concurrently and collect every outcome.
+
+    ``messages`` maps user id -> send_message keyword arguments. At most
+    ``concurrency`` are in flight at once; no exception escapes, failures
+    are returned as Delivery(ok=False).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    deliveries = await asyncio.gather(*(_deliver(bot, semaphore, user_id, kwargs)
+                                        for user_id, kwargs in messages.items()))
+    return {delivery.user_id: delivery for delivery in deliveries}
+
+
+async def report_failures(bot, room, deliveries: Dict[int, Delivery]) -> List[Delivery]:
+    """Tell the room's group which players did not get their PM; returns those deliveries"""
+    failed = [delivery for delivery in deliveries.values() if not delivery.ok]
+    if not failed:
+        return failed
+
+    lines = []
+    for delivery in failed:
+        player = room.players.get(delivery.user_id)
+        name = f"@{player['name']}" if player and player["name"] else str(delivery.user_id)
+        reason = "has not started the bot or blocked it" if delivery.blocked else "could not be reached"
+        lines.append(f"• {name} {reason}")
+    try:
+        await bot.send_message(
+            chat_id=room.chat_id,
+            text="⚠️ Some players did not receive their private message:\n"
+                 + "\n".join(lines)
+                 + "\n\nOpen a private chat with the bot and press /start."
+        )
+    except Exception as e:
+        print(f"Error reporting undelivered messages: {e}")
+    return failed
@@ -17,9 +17,9 @@ from voting_handler import VotingHandler
 voting_handler = VotingHandler()
 
 async def handle_game_loop(room, context):
-    """Main game loop handler"""
+    """Main game loop handler; resumes at room.phase and room.current_round"""
     try:
-        day_number = 1
+        day_number = getattr(room, "current_round", 1)
 
         while room.phase != "ended" and day_number <= 100:  # Max 100 days
             if room.phase == "night":
@@ -43,9 +43,14 @@ async def handle_game_loop(room, context):
                     break
                 room.phase = "night"
                 day_number += 1
+                room.current_round = day_number
+                record("room_updated", room.id, fields={"current_round": day_number})
 
             await asyncio.sleep(1)  # Short delay between phases
 
+        # Finished rooms are removed by room_manager.reap_rooms()
+        room.phase = "ended"
+
     except Exception as e:
         print(f"Error in game loop: {e}")
         try:
@@ -136,6 +141,7 @@ async def assign_roles(players: List[dict], mode: str) -> Dict:
 async def handle_night_phase(room, context):
     """Handle night phase actions"""
     # Send notifications for important role actions
+    messages = {}
     for player in room.get_alive_players():
         if player["role"] in ["Detektif", "Dokter", "Mafia", "Boss Mafia"]:
             if player.get("is_bot", False):
@@ -147,10 +153,8 @@ async def handle_night_phase(room, context):
                     "Mafia": "🔪 Mafia memilih korbannya...",
                     "Boss Mafia": "👑 Boss Mafia memilih targetnya..."
                 }
-                await context.bot.send_message(
-                    chat_id=player["id"], # Send PM to player
-                    text=role_action[player["role"]]
-                )
+                messages[player["id"]] = {"text": role_action[player["role"]]}  # PM to player
+    await report_failures(context.bot, room, await fan_out(context.bot, messages))
 
 async def handle_day_phase(room, context, day_number):
     """Handle day phase discussions"""
@@ -162,16 +166,61 @@ async def handle_voting_phase(room, context):
     # Implementation for voting phase - needs further development to handle voting and results announcement.
     pass
 
+# End-of-game rewards handed to database.settle_game
+WIN_REWARD = {"exp": 100, "points": 100}
+LOSS_REWARD = {"exp": 25, "points": 0}
+
+def winning_team(room):
+    """"Mafia" once the mafia equal or outnumber the others, "Warga" once no mafia is alive"""
+    alive = room.get_alive_players()
+    if not any(p.get("role") for p in room.players):
+        return None  # Roles not dealt yet
+    mafia = sum(1 for p in alive if p.get("role") in MAFIA_ROLES)
+    if mafia == 0:
+        return "Warga"
+    if mafia >= len(alive) - mafia:
+        return "Mafia"
+    return None
+
 async def check_win_condition(room, context):
-    """Check if any team has won"""
-    # Implementation for win condition check - needs further development.
-    pass
+    """Check if any team has won; the first time one has, end and settle the game"""
+    if room.phase == "ended":
+        return True
+    team = winning_team(room)
+    if team is None:
+        return False
+    room.phase = "ended"
+    await settle_room(room, context, team)
+    return True
+
+async def settle_room(room, context, team):
+    """Pay out the finished game of ``room`` and announce the result"""
+    results = []
+    names = {}
+    for player in room.players:
+        won = (player.get("role") in MAFIA_ROLES) == (team == "Mafia")
+        names[player["id"]] = player["name"] or player["id"]
+        results.append({"player_id": player["id"], "won": won, "name": player["name"],
+                        "role": player.get("role"), **(WIN_REWARD if won else LOSS_REWARD)})
+    try:
+        events = await settle_game(results)
+        await context.bot.send_message(
+            chat_id=room.chat_id,
+            text=f"🏁 Permainan selesai! Tim {team} menang!"
+        )
+        await send_settlement_notification(context, room.chat_id, events, names)
+    except Exception as e:
+        print(f"Error settling game: {e}")
 
 
 import random
 import asyncio
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from database import save_database, load_database
+from database import save_database, load_database, record, settle_game, MAFIA_ROLES
+from notifications import send_settlement_notification
+from fanout import fan_out, report_failures
+from pm_handler import send_role_pms
+from room_manager import delete_room
 from game_state import game_data, role_desc, room_state, timer_state
 from game_state import GAME_GIFS
 
@@ -179,7 +228,7 @@ from game_state import GAME_GIFS
 async def process_night_actions(context):
     game_data["phase"] = "day"
     # ... (night processing logic)
-    save_database(game_data)
+    save_database(game_data, keys=["phase"])
 
 async def handle_voting(context, chat_id):
     game_data["phase"] = "voting"
@@ -196,7 +245,7 @@ async def handle_voting(context, chat_id):
         chat_id=chat_id,
         text="🗳️ Voting dimulai! Silakan pilih pemain yang mencurigakan."
     )
-    save_database(game_data)
+    save_database(game_data, keys=["phase", "votes"])
 
 async def calculate_bot_vote(bot, players):
     # Smart bot voting logic based on role and observations
@@ -232,13 +281,12 @@ async def start_game(room, context):
                     InlineKeyboardButton("🎮 Buat Room Baru", callback_data="create_room")
                 ]])
             )
-            if room.id in active_rooms:
-                del active_rooms[room.id]
+            delete_room(room.id)
             return False
 
         # Check minimum player requirement
-        total_real_players = len([p for p in room.players if not p.get('is_bot', False)])
-        total_bots = len([p for p in room.players if p.get('is_bot', False)])
+        total_real_players = room.players.human_count
+        total_bots = room.players.bot_count
 
         if total_real_players + total_bots < 4:
             return False #Do not send message here, handled by caller function
@@ -251,23 +299,13 @@ async def start_game(room, context):
 
         # Assign roles
         roles = await assign_roles(room.players, room.mode)
-        player_mentions = []
 
-        # Send roles to players
         for player in room.players:
-            player_id = player["id"]
-            role = roles[player_id]
-            player["role"] = role
-
-            if not player.get("is_bot", False):
-                try:
-                    await context.bot.send_message(
-                        chat_id=player_id,
-                        text=f"🎭 Peran kamu: {role}\n\n📜 Deskripsi:\n{role_desc.get(role, '')}"
-                    )
-                    player_mentions.append(f"@{player['name']}")
-                except Exception as e:
-                    print(f"Error sending PM to {player_id}: {e}")
+            room.set_role(player, roles[player["id"]])
+        # Role PMs with their action buttons, all at once
+        deliveries = await send_role_pms(context, room)
+        player_mentions = [f"@{room.players.get(user_id)['name']}"
+                           for user_id, delivery in deliveries.items() if delivery.ok]
 
         # Start game announcement
         announcement = (
@@ -345,6 +383,7 @@ async def send_player_pm(bot, player_id, role):
     await bot.send_message(chat_id=player_id, text=pm_message)
 
 async def handle_night_actions(room, context):
+    messages = {}
     for player in room.get_alive_players():
         role = player["role"]
         if role in ["Detektif", "Dokter", "Mafia", "Boss Mafia"]:
@@ -352,17 +391,15 @@ async def handle_night_actions(room, context):
                 # Handle bot actions
                 await handle_bot_night_action(player, room, context)
             else:
-                # Send action notification for real players
+                # Action notification for real players, sent together below
                 role_action = {
                     "Detektif": "🕵️‍ Detektif sedang mencari penjahat...",
                     "Dokter": "👨🏼‍⚕️ Dokter pergi bertugas malam...",
                     "Mafia": "🔪 Mafia memilih korbannya...",
                     "Boss Mafia": "👑 Boss Mafia memilih targetnya..."
                 }
-                await context.bot.send_message(
-                    chat_id=player["id"], # Send PM to player
-                    text=role_action[role]
-                )
+                messages[player["id"]] = {"text": role_action[role]}
+    await report_failures(context.bot, room, await fan_out(context.bot, messages))
 
 async def handle_bot_night_action(bot, room, context):
     # AI logic for bot actions based on role
@@ -0,0 +1,51 @@
+"""
+Room Hibernation
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import time
+from typing import List, Optional
+
+from reaper import ExpiryIndex
+
+
+class RoomHibernator:
+    """Decides when idle rooms are moved out of memory.
+
+    A room becomes a candidate ``idle_after`` seconds after its last
+    activity (Room.touch). room_manager.hibernate_rooms() writes the
+    candidates' state to the store and drops the Room objects; looking a
+    room up again wakes it.
+    """
+
+    def __init__(self, idle_after: float = 120):
+        self.idle_after = idle_after
+        self.index = ExpiryIndex()
+        self.hibernated = 0
+        self.woken = 0
+
+    def touch(self, room):
+        self.index.touch(room.id, room.last_activity + self.idle_after)
+
+    def postpone(self, room_id, now: Optional[float] = None):
+        """Check the room again after another ``idle_after`` seconds"""
+        now = time.time() if now is None else now
+        self.index.touch(room_id, now + self.idle_after)
+
+    def forget(self, room_id):
+        self.index.discard(room_id)
+
+    def due(self, rooms, now: Optional[float] = None) -> List[int]:
+        """Ids of rooms in ``rooms`` (id -> Room) idle for ``idle_after`` seconds"""
+        now = time.time() if now is None else now
+        idle = []
+        for room_id in self.index.pop_expired(now):
+            room = rooms.get(room_id)
+            if room is None:
+                continue
+            if room.last_activity + self.idle_after > now:
+                self.touch(room)
+            else:
+                idle.append(room_id)
+        return idle
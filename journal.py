@@ -0,0 +1,217 @@
+"""
+Game State Journal
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict
+
+# Key in game_data holding the sequence number of the last applied operation
+SEQ_KEY = "journal_seq"
+
+
+def _room(state: Dict, room_id) -> Dict:
+    return state.setdefault("active_rooms", {}).get(str(room_id))
+
+
+def _apply_room_created(state, op):
+    state.setdefault("active_rooms", {})[str(op["room_id"])] = {
+        "creator_id": op["creator_id"],
+        "chat_id": op["chat_id"],
+        "mode": None,
+        "phase": "setup",
+        "players": [],
+        "bot_count": 0,
+        "votes": {},
+        "button_nonce": op.get("button_nonce"),
+        "created_at": op["ts"]
+    }
+
+
+def _apply_player_joined(state, op):
+    room = _room(state, op["room_id"])
+    if room is None:
+        return
+    player = op["player"]
+    if not any(p["id"] == player["id"] for p in room["players"]):
+        room["players"].append(dict(player))
+
+
+def _apply_player_left(state, op):
+    room = _room(state, op["room_id"])
+    if room is not None:
+        room["players"] = [p for p in room["players"] if p["id"] != op["player_id"]]
+
+
+def _apply_role_assigned(state, op):
+    room = _room(state, op["room_id"])
+    if room is None:
+        return
+    for p in room["players"]:
+        if p["id"] == op["player_id"]:
+            p["role"] = op["role"]
+
+
+def _apply_vote_cast(state, op):
+    room = _room(state, op["room_id"])
+    if room is not None:
+        room.setdefault("votes", {})[str(op["voter_id"])] = op["target_id"]
+
+
+def _apply_player_died(state, op):
+    room = _room(state, op["room_id"])
+    if room is None:
+        return
+    for p in room["players"]:
+        if p["id"] == op["player_id"]:
+            p["is_alive"] = False
+
+
+def _apply_room_updated(state, op):
+    room = _room(state, op["room_id"])
+    if room is not None:
+        room.update(op["fields"])
+
+
+def _apply_room_deleted(state, op):
+    state.setdefault("active_rooms", {}).pop(str(op["room_id"]), None)
+
+
+OPERATIONS = {
+    "room_created": _apply_room_created,
+    "player_joined": _apply_player_joined,
+    "player_left": _apply_player_left,
+    "role_assigned": _apply_role_assigned,
+    "vote_cast": _apply_vote_cast,
+    "player_died": _apply_player_died,
+    "room_updated": _apply_room_updated,
+    "room_deleted": _apply_room_deleted,
+}
+
+
+def apply_operation(state: Dict, op: Dict):
+    OPERATIONS[op["op"]](state, op)
+    state[SEQ_KEY] = op["seq"]
+
+
+class GameJournal:
+    """Append-only log of room operations between two snapshots.
+
+    Each line is one JSON operation with a sequence number. The snapshot
+    stores the last sequence it contains, so replay skips anything older
+    and a torn final line (crash mid-append) is ignored.
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._file = None
+        self.seq = 0
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        return self._file
+
+    def make_entry(self, op: str, **fields) -> Dict:
+        """Number a new operation without writing it yet"""
+        with self._lock:
+            self.seq += 1
+            return {"op": op, "seq": self.seq, "ts": time.time(), **fields}
+
+    def write_entry(self, entry: Dict):
+        """Append a numbered operation; entries must be written in seq order"""
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            f = self._open()
+            f.write(line)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def append(self, op: str, **fields) -> Dict:
+        entry = self.make_entry(op, **fields)
+        self.write_entry(entry)
+        return entry
+
+    def replay(self, state: Dict) -> int:
+        """Apply journaled operations newer than the snapshot in ``state``"""
+        applied = 0
+        last_seq = state.get(SEQ_KEY, 0)
+        if not os.path.exists(self.path):
+            return 0
+
+        good_end = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    logging.warning("Ignoring torn journal entry")
+                    break
+                good_end += len(line)
+                if op["seq"] <= last_seq:
+                    continue
+                try:
+                    apply_operation(state, op)
+                except Exception as e:
+                    logging.error(f"Error replaying journal entry {op.get('seq')}: {e}")
+                    continue
+                last_seq = op["seq"]
+                applied += 1
+
+        if good_end < os.path.getsize(self.path):
+            # Cut the torn tail so new entries start on a clean line
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_end)
+        self.seq = max(self.seq, last_seq)
+        return applied
+
+    def position(self) -> int:
+        """Current end of the journal, to pass to compact() once a snapshot covers it"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def compact(self, position: int):
+        """Drop everything before ``position``; keeps entries appended after it"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            with open(self.path, 'rb') as f:
+                f.seek(position)
+                tail = f.read()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def write_atomic(path: str, content):
+    """Write ``content`` (str or bytes) to ``path`` through a temp file and rename"""
+    tmp_path = path + ".tmp"
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
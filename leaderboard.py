@@ -0,0 +1,209 @@
+"""
+Leaderboard Index
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import random
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+METRICS = ("points", "wins", "level")
+
+
+class _Node:
+    __slots__ = ("key", "priority", "left", "right", "size")
+
+    def __init__(self, key):
+        self.key = key
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.size = 1
+
+
+def _size(node) -> int:
+    return node.size if node else 0
+
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _split(node, key):
+    """Split into (keys < key, keys >= key)"""
+    if node is None:
+        return None, None
+    if node.key < key:
+        left, right = _split(node.right, key)
+        node.right = left
+        _update(node)
+        return node, right
+    left, right = _split(node.left, key)
+    node.left = right
+    _update(node)
+    return left, node
+
+
+def _merge(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+class OrderStatisticTree:
+    """Treap keeping subtree sizes: insert, remove and rank in O(log n)"""
+
+    def __init__(self):
+        self._root = None
+
+    def __len__(self):
+        return _size(self._root)
+
+    @classmethod
+    def from_sorted(cls, keys: List) -> "OrderStatisticTree":
+        """Build in O(n) from keys already in ascending order"""
+        tree = cls()
+        if not keys:
+            return tree
+
+        def build(lo, hi):
+            if lo >= hi:
+                return None
+            mid = (lo + hi) // 2
+            node = _Node(keys[mid])
+            node.left = build(lo, mid)
+            node.right = build(mid + 1, hi)
+            _update(node)
+            return node
+
+        tree._root = build(0, len(keys))
+        # Hand out random priorities largest-first in breadth-first order so
+        # every parent outranks its children, as later inserts expect
+        priorities = sorted((random.random() for _ in keys), reverse=True)
+        level, i = [tree._root], 0
+        while level:
+            next_level = []
+            for node in level:
+                node.priority = priorities[i]
+                i += 1
+                next_level.extend(child for child in (node.left, node.right) if child)
+            level = next_level
+        return tree
+
+    def insert(self, key):
+        left, right = _split(self._root, key)
+        self._root = _merge(_merge(left, _Node(key)), right)
+
+    def remove(self, key):
+        left, right = _split(self._root, key)
+        # right starts with key (keys are unique); drop its smallest node
+        if right is not None:
+            _removed, right = self._pop_min(right, key)
+        self._root = _merge(left, right)
+
+    def _pop_min(self, node, key):
+        if node.left is None:
+            if node.key == key:
+                return node, node.right
+            return None, node
+        removed, node.left = self._pop_min(node.left, key)
+        _update(node)
+        return removed, node
+
+    def rank(self, key) -> int:
+        """Number of keys smaller than ``key``"""
+        node, count = self._root, 0
+        while node is not None:
+            if key <= node.key:
+                node = node.left
+            else:
+                count += _size(node.left) + 1
+                node = node.right
+        return count
+
+    def first(self, n: int) -> List:
+        """The ``n`` smallest keys in order"""
+        result, stack, node = [], [], self._root
+        while (stack or node) and len(result) < n:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            result.append(node.key)
+            node = node.right
+        return result
+
+
+class Leaderboard:
+    """Per-metric rankings updated on every stat change.
+
+    The index is built from the user store the first time it is read,
+    so it survives restarts without being persisted itself.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[Tuple[int, Dict]]]):
+        self._loader = loader
+        self._loaded = False
+        self._trees = {metric: OrderStatisticTree() for metric in METRICS}
+        self._keys: Dict[int, Dict[str, tuple]] = {}
+        self._names: Dict[int, str] = {}
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        for user_id, stats in self._loader():
+            if user_id < 0:
+                continue
+            if stats.get("username"):
+                self._names[user_id] = stats["username"]
+            self._keys[user_id] = {metric: (-stats.get(metric, 0), user_id) for metric in METRICS}
+        for metric in METRICS:
+            keys = sorted(user_keys[metric] for user_keys in self._keys.values())
+            self._trees[metric] = OrderStatisticTree.from_sorted(keys)
+
+    def _set(self, user_id: int, stats: Dict):
+        if stats.get("username"):
+            self._names[user_id] = stats["username"]
+        old_keys = self._keys.get(user_id, {})
+        new_keys = {}
+        for metric in METRICS:
+            # Sort descending by value, ties broken by user id
+            key = (-stats.get(metric, 0), user_id)
+            new_keys[metric] = key
+            if old_keys.get(metric) == key:
+                continue
+            if metric in old_keys:
+                self._trees[metric].remove(old_keys[metric])
+            self._trees[metric].insert(key)
+        self._keys[user_id] = new_keys
+
+    def update(self, user_id: int, stats: Dict):
+        """Record new stats for a user; a no-op until the index is first used"""
+        if self._loaded and user_id >= 0:
+            self._set(user_id, stats)
+
+    def top(self, metric: str = "points", n: int = 10) -> List[Tuple[int, int]]:
+        """[(user_id, value), ...] for the best ``n`` users"""
+        self._ensure_loaded()
+        return [(user_id, -value) for value, user_id in self._trees[metric].first(n)]
+
+    def rank(self, user_id: int, metric: str = "points") -> Optional[Tuple[int, int]]:
+        """(1-based rank, total users) or None if the user has no stats"""
+        self._ensure_loaded()
+        key = self._keys.get(user_id, {}).get(metric)
+        if key is None:
+            return None
+        tree = self._trees[metric]
+        return tree.rank(key) + 1, len(tree)
+
+    def name(self, user_id: int) -> str:
+        return self._names.get(user_id, str(user_id))
@@ -0,0 +1,169 @@
+"""
+Lobby Message Renderer
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import hashlib
+import logging
+import math
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from outbox import LOW
+
+# Countdown step sizes (seconds) tried from finest to coarsest
+COUNTDOWN_STEPS = (5, 10, 15, 30, 60)
+
+# (text, [[(label, callback_data), ...], ...]) or None when the lobby is gone
+Render = Optional[Tuple[str, List[List[Tuple[str, str]]]]]
+
+
+class MessageRef:
+    """A message known only by chat and message id, e.g. after a restart.
+
+    Offers the edit_text() the renderer calls on a Message.
+    """
+
+    __slots__ = ("bot", "chat_id", "message_id")
+
+    def __init__(self, bot, chat_id, message_id):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+    async def edit_text(self, text, **kwargs):
+        return await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id, **kwargs)
+
+
+class _Lobby:
+    __slots__ = ("room_id", "chat_id", "message", "render", "remaining",
+                 "last_hash", "pending", "refresh", "step")
+
+    def __init__(self, room_id, chat_id, message, render, remaining):
+        self.room_id = room_id
+        self.chat_id = chat_id
+        self.message = message
+        self.render = render
+        self.remaining = remaining
+        self.last_hash = None
+        self.pending = None
+        self.refresh = None
+        self.step = COUNTDOWN_STEPS[0]
+
+
+class LobbyRenderer:
+    """Keeps each lobby message up to date with as few edits as possible.
+
+    - request() marks a lobby as changed; requests within ``debounce``
+      seconds are merged into one edit.
+    - The rendered text and keyboard are hashed and the edit is skipped
+      when nothing visible changed.
+    - The countdown is shown rounded up to a step that keeps every chat
+      within ``edits_per_minute`` (shared by all lobbies in that chat);
+      the lobby is re-rendered only when the shown value changes.
+    """
+
+    def __init__(self, wheel, debounce: float = 1.0, edits_per_minute: int = 20):
+        self.wheel = wheel
+        self.debounce = debounce
+        self.edits_per_minute = edits_per_minute
+        self._lobbies: Dict[int, _Lobby] = {}
+        self._edits: Dict[int, deque] = {}
+        self.edits_sent = 0
+        self.edits_skipped = 0
+
+    def attach(self, room_id, chat_id, message, render: Callable[[Optional[int]], Render],
+               remaining: Callable[[], float]):
+        """Start managing ``message`` for a room.
+
+        ``render(seconds_shown)`` builds the lobby; ``remaining()`` returns
+        the seconds left on the join countdown.
+        """
+        self.detach(room_id)
+        self._lobbies[room_id] = _Lobby(room_id, chat_id, message, render, remaining)
+        self.request(room_id)
+
+    def detach(self, room_id):
+        lobby = self._lobbies.pop(room_id, None)
+        if lobby is not None:
+            for handle in (lobby.pending, lobby.refresh):
+                if handle is not None:
+                    handle.cancel()
+
+    def request(self, room_id):
+        """Note that a lobby changed; it is redrawn after the debounce delay"""
+        lobby = self._lobbies.get(room_id)
+        if lobby is None or lobby.pending is not None:
+            return
+        try:
+            lobby.pending = self.wheel.schedule(self.debounce, self._flush, room_id)
+        except RuntimeError:
+            # No running event loop (e.g. state rebuilt at import time)
+            pass
+
+    def _recent_edits(self, chat_id) -> deque:
+        edits = self._edits.setdefault(chat_id, deque())
+        cutoff = time.monotonic() - 60
+        while edits and edits[0] < cutoff:
+            edits.popleft()
+        return edits
+
+    def _choose_step(self, chat_id) -> int:
+        """Finest countdown step whose edit rate fits what is left of the budget"""
+        lobbies = sum(1 for lobby in self._lobbies.values() if lobby.chat_id == chat_id)
+        available = max(1, self.edits_per_minute - len(self._recent_edits(chat_id)) // 2)
+        for step in COUNTDOWN_STEPS:
+            if lobbies * 60 / step <= available:
+                return step
+        return COUNTDOWN_STEPS[-1]
+
+    def _schedule_refresh(self, lobby: _Lobby, remaining: float, shown: int):
+        if lobby.refresh is not None:
+            lobby.refresh.cancel()
+            lobby.refresh = None
+        next_shown = shown - lobby.step
+        if next_shown > 0:
+            # Wake when the rounded-up countdown drops to the next step
+            lobby.refresh = self.wheel.schedule(max(0.0, remaining - next_shown), self._flush, lobby.room_id)
+
+    async def _flush(self, room_id):
+        lobby = self._lobbies.get(room_id)
+        if lobby is None:
+            return
+        lobby.pending = None
+
+        edits = self._recent_edits(lobby.chat_id)
+        if len(edits) >= self.edits_per_minute:
+            # Over budget: try again once the oldest edit leaves the window
+            lobby.pending = self.wheel.schedule(edits[0] + 60 - time.monotonic(), self._flush, room_id)
+            return
+
+        lobby.step = self._choose_step(lobby.chat_id)
+        remaining = lobby.remaining()
+        shown = int(math.ceil(remaining / lobby.step) * lobby.step) if remaining > 0 else 0
+        rendered = lobby.render(shown)
+        if rendered is None:
+            self.detach(room_id)
+            return
+        self._schedule_refresh(lobby, remaining, shown)
+
+        text, rows = rendered
+        digest = hashlib.blake2b(repr((text, rows)).encode("utf-8"), digest_size=16).digest()
+        if digest == lobby.last_hash:
+            self.edits_skipped += 1
+            return
+
+        keyboard = [[InlineKeyboardButton(label, callback_data=data) for label, data in row] for row in rows]
+        edits.append(time.monotonic())
+        try:
+            await lobby.message.edit_text(text, reply_markup=InlineKeyboardMarkup(keyboard),
+                                          rate_limit_args={"priority": LOW})
+            lobby.last_hash = digest
+            self.edits_sent += 1
+        except Exception as e:
+            if "not modified" in str(e).lower():
+                lobby.last_hash = digest
+            else:
+                logging.error(f"Error updating lobby message: {e}")
@@ -5,52 +5,157 @@ Created by @berlinnad
 Copyright (c) 2024 Berlinnad. All rights reserved.
 """
 
+import argparse
 import logging
 import asyncio
+import os
+import secrets
+import signal
 from telegram import Update
 from telegram.ext import Application, CommandHandler as TelegramCommandHandler, CallbackQueryHandler, MessageHandler, filters
 from bot_commands import *
 from game_state import game_data
-from database import load_database
+from database import load_database, start_persistence, flush as flush_database
+from persistence import LoopStallMonitor
+from outbox import Outbox
+from callback_pipeline import CallbackPipeline
+from router import callback_router
+import button_handler, pm_handler  # register their button actions with callback_router
+from room_manager import reap_rooms_job, hibernate_rooms_job, restore_rooms, room_ids
 from command_handler import CommandHandler
 
 # Initialize logging and command handler
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 command_handler = CommandHandler()
+loop_monitor = LoopStallMonitor()
+# Every Bot API request is queued and rate limited here
+outbox = Outbox()
+# Answers button presses quickly while their handlers run in the background
+callback_pipeline = CallbackPipeline()
 
 def error_handler(update, context):
     """Handle errors"""
     logger.error(f"Error occurred: {context.error}")
 
-def main():
-    from config import BOT_TOKEN, ENCRYPTION_KEY
+async def on_startup(application):
+    """Start background persistence and event loop lag reporting, then resume the saved rooms"""
+    start_persistence()
+    # Lease the first block of room ids off the event loop
+    room_ids.prefetch()
+    loop_monitor.start()
+    try:
+        restored = restore_rooms(application)
+        if restored:
+            logger.info(f"Restored {restored} rooms from the saved game state")
+    except Exception as e:
+        logger.error(f"Error restoring rooms: {e}")
+
+async def on_stop(application):
+    """Let running button handlers finish while the bot can still send"""
+    await callback_pipeline.shutdown()
+
+async def on_shutdown(application):
+    """Write any buffered game data"""
+    loop_monitor.stop()
+    flush_database()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="MafiosoNnad Bot")
+    parser.add_argument("--webhook", action="store_true",
+                        help="Receive updates on a webhook (webhook.py) instead of long polling")
+    parser.add_argument("--webhook-url",
+                        help="Public URL to register with Telegram; without it only local posts arrive (fake_updates.py)")
+    parser.add_argument("--listen", default="0.0.0.0", help="Webhook listen address")
+    parser.add_argument("--port", type=int, default=8443, help="Webhook port")
+    parser.add_argument("--path", default="/telegram", help="Webhook path")
+    parser.add_argument("--secret", default=os.environ.get("WEBHOOK_SECRET"),
+                        help="Webhook secret token (default: $WEBHOOK_SECRET, else a random one)")
+    parser.add_argument("--cert", help="TLS certificate to serve (and upload to Telegram)")
+    parser.add_argument("--key", help="TLS private key of --cert")
+    parser.add_argument("--self-signed", metavar="HOST",
+                        help="Generate a self-signed certificate for HOST and serve with it")
+    parser.add_argument("--max-pending", type=int, default=1000,
+                        help="Queued updates at which the webhook starts answering 503")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Worker processes to split the chats across (sharding.py); 1 runs everything here")
+    return parser.parse_args(argv)
+
+def build_application():
+    """The Application with every handler and job registered"""
+    from config import BOT_TOKEN
+
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(True)
+        .rate_limiter(outbox)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+
+    # Register all command handlers
+    application.add_handler(TelegramCommandHandler("start", start))
+    application.add_handler(TelegramCommandHandler("help", help_command))
+    application.add_handler(TelegramCommandHandler("denyroom", denyroom))
+    application.add_handler(TelegramCommandHandler("extend", extend))
+    application.add_handler(TelegramCommandHandler("startgame", startgame))
+    application.add_handler(TelegramCommandHandler("top", top))
+
+    # Put idle rooms to sleep and remove finished ones
+    if application.job_queue:
+        application.job_queue.run_repeating(reap_rooms_job, interval=60, first=60, name="reap_rooms")
+        application.job_queue.run_repeating(hibernate_rooms_job, interval=30, first=30, name="hibernate_rooms")
+    else:
+        logger.warning("JobQueue unavailable (install python-telegram-bot[job-queue]); rooms will not be hibernated or reaped")
+
+    # One callback query handler; router.py dispatches on the button's action
+    application.add_handler(CallbackQueryHandler(callback_pipeline.wrap(callback_router.dispatch)))
+
+    # Add error handler
+    application.add_error_handler(error_handler)
+    return application
+
+async def serve_webhook(application, args):
+    """Run until SIGINT/SIGTERM with updates arriving on the webhook"""
+    from webhook import WebhookServer, run_webhook, self_signed_cert
+
+    cert, key = args.cert, args.key
+    if args.self_signed:
+        cert, key = "webhook_cert.pem", "webhook_key.pem"
+        self_signed_cert(args.self_signed, cert, key)
+    secret = args.secret
+    if not secret:
+        secret = secrets.token_urlsafe(32)
+        logger.warning("No webhook secret given; generated a random one")
+
+    server = WebhookServer(application, secret, path=args.path, listen=args.listen, port=args.port,
+                           max_pending=args.max_pending, cert=cert, key=key, url=args.webhook_url)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await run_webhook(application, server, stop)
 
+def main(argv=None):
+    args = parse_args(argv)
     try:
-        application = (
-            Application.builder()
-            .token(BOT_TOKEN)
-            .concurrent_updates(True)
-            .build()
-        )
-
-        # Register all command handlers
-        application.add_handler(TelegramCommandHandler("start", start))
-        application.add_handler(TelegramCommandHandler("help", help_command))
-        application.add_handler(TelegramCommandHandler("denyroom", denyroom))
-        application.add_handler(TelegramCommandHandler("extend", extend))
-        application.add_handler(TelegramCommandHandler("startgame", startgame))
-
-        # Add callback query handler
-        application.add_handler(CallbackQueryHandler(handle_callback))
-
-        # Add error handler
-        application.add_error_handler(error_handler)
-
-        # Load database and start bot
-        load_database(game_data)
+        if args.shards > 1:
+            # This process only receives updates; the workers load their own game data
+            from sharding import build_front
+            application = build_front(args.shards)
+        else:
+            application = build_application()
+            # Load database and start bot; updates sent while restarting are kept
+            # so they reach the restored rooms
+            load_database(game_data)
         print("Starting bot...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+        if args.webhook:
+            asyncio.run(serve_webhook(application, args))
+        else:
+            application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=False)
 
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
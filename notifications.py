@@ -1,5 +1,6 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 import asyncio
+from outbox import LOW
 from game_state import GAME_GIFS # Added import statement
 
 async def send_join_notification(context, chat_id, player_name):
@@ -24,7 +25,8 @@ async def send_timer_notification(context, chat_id, time_left, player_count, mod
     try:
         await context.bot.send_message(
             chat_id=chat_id,
-            text=text
+            text=text,
+            rate_limit_args={"priority": LOW}
         )
     except Exception as e:
         print(f"Error sending timer notification: {e}")
@@ -50,3 +52,22 @@ async def send_extend_notification(context, chat_id, seconds):
         )
     except Exception as e:
         print(f"Error sending extend notification: {e}")
+
+async def send_settlement_notification(context, chat_id, events, player_names):
+    """Announce level-ups and achievements returned by database.settle_game"""
+    lines = []
+    for event in events:
+        name = player_names.get(event["player_id"], event["player_id"])
+        if event["type"] == "level_up":
+            lines.append(f"⬆️ @{name} reached level {event['level']}!")
+        elif event["type"] == "achievement":
+            lines.append(f"🎉 @{name} earned {event['name']} (+{event['reward']} points)")
+    if not lines:
+        return
+    try:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="\n".join(lines)
+        )
+    except Exception as e:
+        print(f"Error sending settlement notification: {e}")
@@ -0,0 +1,408 @@
+"""
+Outbound Telegram Queue
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from typing import Any, Dict, Optional
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+# Bot API methods that do not post to a chat; they skip the buckets
+UNLIMITED_ENDPOINTS = frozenset({
+    "getUpdates", "getMe", "answerCallbackQuery", "getFile",
+    "setWebhook", "deleteWebhook", "getWebhookInfo",
+})
+
+# Priority classes, passed as rate_limit_args={"priority": ...}; lower goes first.
+# Without one, private chats (role PMs, night actions) are HIGH and groups NORMAL.
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+# Edits that replace the whole message; a newer pending one makes older ones moot
+COLLAPSIBLE_ENDPOINTS = frozenset({"editMessageText"})
+
+
+def _seconds(value) -> float:
+    # RetryAfter.retry_after is an int, or a timedelta on newer releases
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+class TokenBucket:
+    """``rate`` tokens per second, holding at most ``capacity``"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, until: float):
+        """Hand out nothing before ``until`` (e.g. after a RetryAfter)"""
+        self.paused_until = max(self.paused_until, until)
+        self.tokens = 0
+
+
+class _Request:
+    __slots__ = ("priority", "seq", "granted", "dropped", "replaced_by", "outcome")
+
+    def __init__(self, priority: int, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.granted = None
+        self.dropped = False
+        self.replaced_by = None
+        self.outcome = None
+
+
+class _Gate:
+    """Hands out a bucket's tokens to waiting requests, highest priority first.
+
+    An ``exclusive`` gate also lets only one request through at a time
+    (until release()), which keeps the sends to one chat in order.
+    """
+
+    __slots__ = ("bucket", "exclusive", "busy", "_waiters", "_task")
+
+    def __init__(self, bucket: TokenBucket, exclusive: bool = False):
+        self.bucket = bucket
+        self.exclusive = exclusive
+        self.busy = False
+        self._waiters = []
+        self._task = None
+
+    def __len__(self):
+        return len(self._waiters)
+
+    def waiting(self):
+        return [request for _, _, request in self._waiters if not request.granted.done()]
+
+    async def acquire(self, request: _Request) -> bool:
+        """Wait for a token; False if the request was dropped meanwhile"""
+        if request.dropped:
+            return False
+        if not self._waiters and not self.busy and self.bucket.wait_time(time.monotonic()) <= 0:
+            self.bucket.take()
+            self.busy = self.exclusive
+            return True
+        request.granted = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (request.priority, request.seq, request))
+        self._wake()
+        try:
+            return await request.granted
+        except asyncio.CancelledError:
+            if request.granted.done() and not request.granted.cancelled() and request.granted.result():
+                self.release()
+            raise
+
+    def release(self):
+        if self.exclusive:
+            self.busy = False
+            self._wake()
+
+    def _wake(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._waiters and not self.busy:
+            request = self._waiters[0][2]
+            if request.granted.done():
+                # Dropped or cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            wait = self.bucket.wait_time(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self._waiters)
+            self.bucket.take()
+            self.busy = self.exclusive
+            request.granted.set_result(True)
+
+
+class _Chat:
+    __slots__ = ("gate", "waiting", "last_used")
+
+    def __init__(self, bucket: TokenBucket):
+        self.gate = _Gate(bucket, exclusive=True)
+        self.waiting = 0
+        self.last_used = time.monotonic()
+
+
+class Outbox(BaseRateLimiter):
+    """Rate limiter every Bot API call goes through.
+
+    Installed with ``Application.builder().rate_limiter(Outbox())``, so
+    ``context.bot.send_message`` and friends queue here and still return
+    their result to the awaiting caller.
+
+    - A global bucket keeps the bot under ``overall_per_second`` requests.
+    - Each chat has its own bucket: ``private_per_second`` for users,
+      ``group_per_minute`` for groups (negative ids). Requests to one
+      chat are sent one at a time.
+    - Both hand out tokens by priority (HIGH, NORMAL, LOW), then by
+      arrival, so a busy lobby cannot hold up a role PM elsewhere.
+    - A pending editMessageText is dropped when a newer edit of the same
+      message is queued; its caller gets the newer edit's result, or
+      sends its own edit after all if the newer one's caller is cancelled.
+    - Once more than ``max_backlog`` requests are queued, LOW ones are
+      dropped (queued ones first) and their callers get None.
+    - RetryAfter pauses the chat's bucket for the time Telegram asks
+      (plus jitter) before retrying; network errors are retried with
+      jittered exponential backoff. BadRequest is not retried, nor is
+      TimedOut, as the message may already have been delivered.
+    - stats() reports queue depth and retry counts.
+    """
+
+    def __init__(self, overall_per_second: float = 30, private_per_second: float = 1.0,
+                 group_per_minute: float = 20, max_retries: int = 3, backoff: float = 1.0,
+                 jitter: float = 1.0, max_backlog: int = 100, report_every: float = 60.0):
+        self.overall = _Gate(TokenBucket(overall_per_second, overall_per_second))
+        self.max_backlog = max_backlog
+        self.private_per_second = private_per_second
+        self.group_per_minute = group_per_minute
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.jitter = jitter
+        self.report_every = report_every
+        self._chats: Dict[Any, _Chat] = {}
+        # (chat_id, message_id) -> newest pending edit of that message
+        self._edits: Dict[tuple, _Request] = {}
+        self._seq = itertools.count()
+        self._last_report = time.monotonic()
+        self.queued = 0
+        self.max_queued = 0
+        self.reset()
+
+    def reset(self):
+        self.sent = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.collapsed = 0
+        self.dropped = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self) -> Dict[str, float]:
+        backlogs = [chat.waiting for chat in self._chats.values() if chat.waiting]
+        return {
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "busy_chats": len(backlogs),
+            "max_chat_backlog": max(backlogs, default=0),
+            "sent": self.sent,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "failed": self.failed,
+            "collapsed": self.collapsed,
+            "dropped": self.dropped,
+        }
+
+    def _chat(self, chat_id) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.group_per_minute / 60, 3)
+            else:
+                bucket = TokenBucket(self.private_per_second, 1)
+            chat = self._chats[chat_id] = _Chat(bucket)
+        chat.last_used = time.monotonic()
+        return chat
+
+    async def _acquire(self, request: _Request, chat: Optional[_Chat]) -> bool:
+        if chat is not None and not await chat.gate.acquire(request):
+            return False
+        try:
+            granted = await self.overall.acquire(request)
+        except BaseException:
+            # Cancelled while holding the chat: let its next send through
+            if chat is not None:
+                chat.gate.release()
+            raise
+        if not granted and chat is not None:
+            chat.gate.release()
+        return granted
+
+    async def _send(self, callback, args, kwargs, request: _Request, chat: Optional[_Chat]):
+        attempt = 0
+        while True:
+            if not await self._acquire(request, chat):
+                return None
+            try:
+                result = await callback(*args, **kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                self.rate_limited += 1
+                if attempt >= self.max_retries:
+                    raise
+                delay = _seconds(e.retry_after) + random.uniform(0, self.jitter)
+                (chat.gate.bucket if chat else self.overall.bucket).pause(time.monotonic() + delay)
+            except (BadRequest, TimedOut):
+                # BadRequest subclasses NetworkError but would fail again
+                raise
+            except NetworkError:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            finally:
+                if chat is not None:
+                    chat.gate.release()
+            attempt += 1
+            self.retries += 1
+
+    def _priority(self, data, rate_limit_args) -> int:
+        if isinstance(rate_limit_args, dict) and "priority" in rate_limit_args:
+            return rate_limit_args["priority"]
+        chat_id = data.get("chat_id")
+        return HIGH if isinstance(chat_id, int) and chat_id > 0 else NORMAL
+
+    def _resend(self, request: _Request) -> _Request:
+        """A fresh request to queue ``request``'s call again.
+
+        The gates may still hold the old one, so it is not reused; the
+        outcome carries over.
+        """
+        again = _Request(request.priority, next(self._seq))
+        again.outcome = request.outcome
+        return again
+
+    def _drop(self, request: _Request):
+        request.dropped = True
+        if request.granted is not None and not request.granted.done():
+            request.granted.set_result(False)
+
+    def _shed(self):
+        """Drop queued LOW requests, oldest first, until the backlog fits.
+
+        The newest pending edit of a message is kept, so the message does
+        not end up showing stale text.
+        """
+        excess = self.queued - self.max_backlog + 1
+        if excess <= 0:
+            return
+        low = {r.seq: r for r in self.overall.waiting() if r.priority >= LOW and r.outcome is None}
+        for chat in self._chats.values():
+            low.update((r.seq, r) for r in chat.gate.waiting() if r.priority >= LOW and r.outcome is None)
+        for _, request in sorted(low.items())[:excess]:
+            self._drop(request)
+            self.dropped += 1
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        request = _Request(self._priority(data, rate_limit_args), next(self._seq))
+        chat_id = data.get("chat_id")
+        edit_key = None
+        if endpoint in COLLAPSIBLE_ENDPOINTS and chat_id is not None and data.get("message_id") is not None:
+            edit_key = (chat_id, data["message_id"])
+
+        if self.queued >= self.max_backlog:
+            # An edit replacing a pending one does not add to the backlog
+            if request.priority >= LOW and edit_key not in self._edits:
+                self.dropped += 1
+                return None
+            self._shed()
+
+        if edit_key is not None:
+            previous = self._edits.get(edit_key)
+            if previous is not None:
+                previous.replaced_by = request
+                self._drop(previous)
+                self.collapsed += 1
+            self._edits[edit_key] = request
+            request.outcome = asyncio.get_running_loop().create_future()
+
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        chat = None
+        try:
+            if chat_id is not None:
+                chat = self._chat(chat_id)
+                chat.waiting += 1
+            # Inline message edits and the like have no chat: only the global limit applies
+            result = await self._send(callback, args, kwargs, request, chat)
+            while request.replaced_by is not None:
+                replacement = request.replaced_by
+                # Returns once the newer edit settles, however it ends
+                await asyncio.wait((replacement.outcome,))
+                if not replacement.outcome.cancelled():
+                    result = replacement.outcome.result()
+                    break
+                # Its caller was cancelled: wait for a still newer edit, else send this one after all
+                newer = replacement.replaced_by or self._edits.get(edit_key)
+                if newer is None:
+                    request = self._resend(request)
+                    self._edits[edit_key] = request
+                    result = await self._send(callback, args, kwargs, request, chat)
+                else:
+                    request.replaced_by = newer
+            if request.outcome is not None:
+                request.outcome.set_result(result)
+            return result
+        except Exception as e:
+            self.failed += 1
+            if request.outcome is not None and not request.outcome.done():
+                request.outcome.set_exception(e)
+                # Only a replaced edit reads it; don't warn when nobody does
+                request.outcome.exception()
+            raise
+        finally:
+            if request.outcome is not None and not request.outcome.done():
+                # Cancelled: an older edit waiting on this one sends its own
+                request.outcome.cancel()
+            self.queued -= 1
+            if chat is not None:
+                chat.waiting -= 1
+            if edit_key is not None and self._edits.get(edit_key) is request:
+                del self._edits[edit_key]
+            self._maybe_report()
+
+    def _maybe_report(self):
+        now = time.monotonic()
+        if now - self._last_report < self.report_every:
+            return
+        stats = self.stats()
+        logging.info(
+            f"Outbox: {stats['sent']} sent, {stats['queued']} queued (max {stats['max_queued']}), "
+            f"{stats['busy_chats']} busy chats, {stats['retries']} retries, "
+            f"{stats['rate_limited']} rate limited, {stats['failed']} failed, "
+            f"{stats['collapsed']} edits collapsed, {stats['dropped']} low priority dropped"
+        )
+        # Forget chats that have been quiet long enough for their bucket to refill
+        for chat_id, chat in list(self._chats.items()):
+            if not chat.waiting and now - chat.last_used > 60:
+                del self._chats[chat_id]
+        self.reset()
+        self._last_report = now
@@ -0,0 +1,353 @@
+"""
+Write-Behind Persistence Layer
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+import snapshot_codec
+
+# Sections of game_data that are tracked entry by entry
+ROOMS_KEY = "active_rooms"
+PLAYERS_KEY = "player_stats"
+
+
+class WriteBehindCache:
+    """Coalesces save requests for game_data and flushes only what changed.
+
+    Callers mark top-level keys, rooms or players as dirty. Every dirty
+    part is re-encoded once at flush time, and the rest of the document
+    is reused from the previous flush. A flush happens when the interval
+    has passed or when too many parts are dirty.
+    """
+
+    def __init__(self, writer: Callable[[bytes], None], interval: float = 1.0, max_dirty: int = 256,
+                 codec=None):
+        self._writer = writer
+        self.codec = codec or snapshot_codec.get_codec()
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self._source: Optional[Dict] = None
+        self._lock = threading.RLock()
+
+        self._dirty_all = False
+        self._dirty_keys = set()
+        self._dirty_rooms = set()
+        self._dirty_players = set()
+
+        # Encoded (key, value) pairs kept from earlier flushes
+        self._fragments: Dict[str, tuple] = {}
+        self._room_fragments: Dict[str, tuple] = {}
+        self._player_fragments: Dict[str, tuple] = {}
+
+        self._last_flush = 0.0
+        self._scheduled = None
+        self.flush_count = 0
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty_keys) + len(self._dirty_rooms) + len(self._dirty_players)
+
+    @property
+    def has_pending(self) -> bool:
+        return self._dirty_all or self.dirty_count > 0
+
+    def mark_dirty(self, data: Dict, keys: Optional[Iterable[str]] = None,
+                   room_id=None, player_id=None, player_ids: Optional[Iterable] = None,
+                   room_ids: Optional[Iterable] = None):
+        """Record that part of ``data`` changed and schedule a flush"""
+        with self._lock:
+            if self._source is not data:
+                # A different dict is being saved: nothing cached applies to it
+                self._source = data
+                self._dirty_all = True
+
+            hinted = False
+            if keys is not None:
+                self._dirty_keys.update(keys)
+                hinted = True
+            if room_id is not None:
+                self._dirty_rooms.add(str(room_id))
+                hinted = True
+            if room_ids is not None:
+                self._dirty_rooms.update(str(rid) for rid in room_ids)
+                hinted = True
+            if player_id is not None:
+                self._dirty_players.add(str(player_id))
+                hinted = True
+            if player_ids is not None:
+                self._dirty_players.update(str(pid) for pid in player_ids)
+                hinted = True
+            if not hinted:
+                self._dirty_all = True
+
+            overdue = time.monotonic() - self._last_flush >= self.interval
+            if overdue or self.dirty_count >= self.max_dirty:
+                self.flush()
+                return
+
+            self._schedule()
+
+    def _schedule(self):
+        if self._scheduled is not None:
+            return
+        delay = max(0.0, self.interval - (time.monotonic() - self._last_flush))
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts, startup): write straight away
+            self.flush()
+            return
+        self._scheduled = loop.call_later(delay, self.flush)
+
+    def _pair(self, key, value) -> tuple:
+        return self.codec.pack_key(key), self.codec.pack(value)
+
+    def _encode_map(self, section: Dict, fragments: Dict[str, tuple], dirty: set, rebuild: bool) -> bytes:
+        if rebuild:
+            fragments.clear()
+            for entry_id, value in section.items():
+                fragments[str(entry_id)] = self._pair(entry_id, value)
+        else:
+            for entry_id in dirty:
+                if entry_id in section:
+                    fragments[entry_id] = self._pair(entry_id, section[entry_id])
+                elif entry_id.lstrip("-").isdigit() and int(entry_id) in section:
+                    fragments[entry_id] = self._pair(int(entry_id), section[int(entry_id)])
+                else:
+                    fragments.pop(entry_id, None)
+        return self.codec.assemble_map(fragments.values())
+
+    def _encode(self) -> bytes:
+        data = self._source
+        rebuild = self._dirty_all
+        dirty_keys = set(data.keys()) if rebuild else self._dirty_keys
+
+        for key in list(self._fragments):
+            if key not in data:
+                del self._fragments[key]
+
+        for key in dirty_keys:
+            if key not in data or key in (ROOMS_KEY, PLAYERS_KEY):
+                continue
+            self._fragments[key] = self._pair(key, data[key])
+
+        if isinstance(data.get(ROOMS_KEY), dict):
+            self._fragments[ROOMS_KEY] = (self.codec.pack_key(ROOMS_KEY), self._encode_map(
+                data[ROOMS_KEY], self._room_fragments, self._dirty_rooms,
+                rebuild or ROOMS_KEY in dirty_keys
+            ))
+        if isinstance(data.get(PLAYERS_KEY), dict):
+            self._fragments[PLAYERS_KEY] = (self.codec.pack_key(PLAYERS_KEY), self._encode_map(
+                data[PLAYERS_KEY], self._player_fragments, self._dirty_players,
+                rebuild or PLAYERS_KEY in dirty_keys
+            ))
+
+        return snapshot_codec.header(self.codec) + self.codec.assemble_map(self._fragments.values())
+
+    def flush(self):
+        """Write pending changes now. Safe to call when nothing is dirty."""
+        with self._lock:
+            if self._scheduled is not None:
+                self._scheduled.cancel()
+                self._scheduled = None
+            if self._source is None or not self.has_pending:
+                return
+
+            try:
+                text = self._encode()
+            except Exception as e:
+                logging.error(f"Error encoding game data: {e}")
+                return
+
+            self._dirty_all = False
+            self._dirty_keys.clear()
+            self._dirty_rooms.clear()
+            self._dirty_players.clear()
+            self._last_flush = time.monotonic()
+            self.flush_count += 1
+
+        self._writer(text)
+
+
+class PersistenceWorker:
+    """Runs file and database writes on one background thread.
+
+    Jobs run in submission order, so a snapshot queued after some journal
+    appends always sees them on disk. submit() never blocks the caller: a
+    job with a ``key`` replaces a queued job with the same key that has
+    not started yet (only the newest snapshot is worth writing), and past
+    ``high_water`` queued jobs it warns that the worker is falling behind.
+    """
+
+    def __init__(self, high_water: int = 10000):
+        self.high_water = high_water
+        # [future, fn, args, key] lists; fn is None once a newer job replaced it
+        self._jobs = collections.deque()
+        self._keyed: Dict[str, list] = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._behind = False
+        self.processed = 0
+        self.errors = 0
+        self.coalesced = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def depth(self) -> int:
+        return len(self._jobs)
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._run, name="persistence", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                job = self._jobs.popleft()
+                if job is None:
+                    break
+                future, fn, args, key = job
+                if fn is None:
+                    continue
+                if key is not None:
+                    self._keyed.pop(key, None)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Error in persistence job {getattr(fn, '__name__', fn)}: {e}")
+                future.set_exception(e)
+            finally:
+                self.processed += 1
+
+    def submit(self, fn: Callable, *args, key: Optional[str] = None) -> concurrent.futures.Future:
+        """Queue ``fn(*args)``; runs inline when the worker isn't started.
+
+        With ``key``, a queued job of the same key that has not started is
+        dropped in favour of this one and its future completes with it.
+        """
+        if not self.running:
+            future = concurrent.futures.Future()
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                logging.error(f"Error in persistence job {getattr(fn, '__name__', fn)}: {e}")
+                future.set_exception(e)
+            return future
+
+        with self._cond:
+            replaced = self._keyed.get(key) if key is not None else None
+            if replaced is not None:
+                # Keep the caller's future; the job moves to the back of the queue
+                future = replaced[0]
+                replaced[1] = None
+                self.coalesced += 1
+            else:
+                future = concurrent.futures.Future()
+            job = [future, fn, args, key]
+            self._jobs.append(job)
+            if key is not None:
+                self._keyed[key] = job
+            self._cond.notify()
+
+            if len(self._jobs) >= self.high_water:
+                if not self._behind:
+                    self._behind = True
+                    logging.warning(f"Persistence worker is {len(self._jobs)} jobs behind")
+            else:
+                self._behind = False
+        return future
+
+    async def submit_durable(self, fn: Callable, *args):
+        """Queue ``fn(*args)`` and wait until it has actually run"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    async def barrier(self):
+        """Wait until every job queued so far has finished"""
+        await self.submit_durable(lambda: None)
+
+    def stop(self, timeout: float = 10.0):
+        """Finish the queued jobs and stop the thread"""
+        if not self.running:
+            return
+        with self._cond:
+            self._jobs.append(None)
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+
+class LoopStallMonitor:
+    """Measures how late the event loop wakes up from a short sleep.
+
+    Any lateness is time the loop spent blocked, for example in a sync
+    json.dump inside a handler.
+    """
+
+    def __init__(self, interval: float = 0.05, report_every: float = 60.0):
+        self.interval = interval
+        self.report_every = report_every
+        self._task = None
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0  # wakeups more than 100ms late
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "samples": self.samples,
+            "mean_lag_ms": (self.total_lag / self.samples * 1000) if self.samples else 0.0,
+            "max_lag_ms": self.max_lag * 1000,
+            "stalls_over_100ms": self.stalls,
+        }
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        last_report = loop.time()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - before - self.interval)
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag > 0.1:
+                self.stalls += 1
+
+            if loop.time() - last_report >= self.report_every:
+                stats = self.stats()
+                logging.info(
+                    f"Event loop lag: mean {stats['mean_lag_ms']:.1f}ms, "
+                    f"max {stats['max_lag_ms']:.1f}ms, {stats['stalls_over_100ms']} stalls >100ms"
+                )
+                self.reset()
+                last_report = loop.time()
@@ -1,81 +1,75 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from game_state import game_data, role_desc
-from room_manager import get_room
-
-async def send_role_pm(player_id, role, context, room_id):
-    """Send role PM with appropriate buttons"""
-    room = get_room(room_id)
-    if not room:
-        return
+from fanout import fan_out, report_failures
+from router import CallbackData, callback_router
 
+def role_pm(role, room):
+    """send_message arguments for a role PM with the role's action buttons"""
+    room_id = room.id
     role_text = role_desc.get(role, "")
     keyboard = []
     
     # Get player list for actions
-    player_list = [p for p in room.players if p["is_alive"]]
+    player_list = room.get_alive_players()
     buttons = []
     
     # Add role-specific buttons
     if role == "Mafia":
         for p in player_list:
             if not p.get("is_bot", False):
-                buttons.append(InlineKeyboardButton(f"🔪 Kill {p['name']}", callback_data=f"kill_{room_id}_{p['id']}"))
+                buttons.append(InlineKeyboardButton(f"🔪 Kill {p['name']}", callback_data=CallbackData("kill", room_id, p["id"]).encode()))
         keyboard = [buttons[i:i+2] for i in range(0, len(buttons), 2)]
-    elif role == "Detective":
+    elif role in ("Detective", "Detektif"):
         for p in player_list:
             if not p.get("is_bot", False):
-                buttons.append(InlineKeyboardButton(f"🔍 Check {p['name']}", callback_data=f"investigate_{room_id}_{p['id']}"))
+                buttons.append(InlineKeyboardButton(f"🔍 Check {p['name']}", callback_data=CallbackData("investigate", room_id, p["id"]).encode()))
         keyboard = [buttons[i:i+2] for i in range(0, len(buttons), 2)]
-    elif role == "Docter":
+    elif role in ("Doctor", "Docter", "Dokter"):
         for p in player_list:
             if not p.get("is_bot", False):
-                buttons.append(InlineKeyboardButton(f"💉 Heal {p['name']}", callback_data=f"heal_{room_id}_{p['id']}"))
+                buttons.append(InlineKeyboardButton(f"💉 Heal {p['name']}", callback_data=CallbackData("heal", room_id, p["id"]).encode()))
         keyboard = [buttons[i:i+2] for i in range(0, len(buttons), 2)]
     elif role == "Boss Mafia":
         for p in player_list:
             if not p.get("is_bot", False):
-                buttons.append(InlineKeyboardButton(f"👑 Kill {p['name']}", callback_data=f"boss_kill_{room_id}_{p['id']}"))
+                buttons.append(InlineKeyboardButton(f"👑 Kill {p['name']}", callback_data=CallbackData("boss_kill", room_id, p["id"]).encode()))
         keyboard = [buttons[i:i+2] for i in range(0, len(buttons), 2)]
 
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await context.bot.send_message(
-        chat_id=player_id,
-        text=f"🎭 Your role: {role}\n\n📜 Description:\n{role_text}",
-        reply_markup=reply_markup
-    )
+    return {"text": f"🎭 Your role: {role}\n\n📜 Description:\n{role_text}", "reply_markup": reply_markup}
+
+async def send_role_pms(context, room):
+    """Send every human player of ``room`` their role PM at once.
+
+    Players the bot cannot reach are listed in the group; returns the
+    fanout.Delivery of each player.
+    """
+    messages = {p["id"]: role_pm(p["role"], room) for p in room.players.humans() if p["role"]}
+    deliveries = await fan_out(context.bot, messages)
+    await report_failures(context.bot, room, deliveries)
+    return deliveries
+
+async def handle_night_action(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
+    """kill / investigate / heal / boss_kill / lawyer_protect buttons of the role PMs"""
+    # Handle night action on data.target_id in room data.room_id
+    pass
+
+async def handle_player_ready(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
+    query = update.callback_query
+    game_data["waiting_for_roles"].discard(update.effective_user.id)
+    await query.answer("You're ready!")
+    await query.edit_message_reply_markup(None)
 
-async def handle_pm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle PM button callbacks"""
+async def handle_leave_game(update: Update, context: ContextTypes.DEFAULT_TYPE, data: CallbackData):
     query = update.callback_query
     user_id = update.effective_user.id
+    if user_id in game_data["players"]:
+        game_data["players"] = [p for p in game_data["players"] if p["id"] != user_id]
+        await query.answer("You left the game")
+        await query.message.delete()
 
-    if query.data.startswith("kill_"):
-        room_id = int(query.data.split("_")[1])
-        # Handle kill action
-        pass
-    elif query.data.startswith("investigate_"):
-        room_id = int(query.data.split("_")[1])
-        # Handle investigate action
-        pass
-    elif query.data.startswith("heal_"):
-        room_id = int(query.data.split("_")[1])
-        # Handle heal action
-        pass
-    elif query.data.startswith("boss_kill_"):
-        room_id = int(query.data.split("_")[1])
-        # Handle boss kill action
-        pass
-    elif query.data.startswith("lawyer_protect_"):
-        room_id = int(query.data.split("_")[1])
-        #Handle lawyer protect action
-        pass
-    elif query.data == "player_ready":
-        game_data["waiting_for_roles"].discard(user_id)
-        await query.answer("You're ready!")
-        await query.edit_message_reply_markup(None)
-    elif query.data == "leave_game":
-        if user_id in game_data["players"]:
-            game_data["players"] = [p for p in game_data["players"] if p["id"] != user_id]
-            await query.answer("You left the game")
-            await query.message.delete()
+for action in ("kill", "investigate", "heal", "boss_kill", "lawyer_protect"):
+    callback_router.register(action, handle_night_action)
+callback_router.register("player_ready", handle_player_ready)
+callback_router.register("leave_game", handle_leave_game)
@@ -0,0 +1,280 @@
+"""
+Player Profiles
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import copy
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# Old key names still used by handlers and stored in game_data["player_stats"]
+ALIASES = {"games": "games_played"}
+
+
+@dataclass
+class PlayerProfile:
+    """Everything stored about a player: progress, stats and shop inventory.
+
+    Supports dict-style access (``profile["wins"]``, ``profile.get("games")``)
+    so handlers written against the old stat dicts keep working.
+    """
+
+    points: int = 0
+    level: int = 1
+    exp: int = 0
+    games_played: int = 0
+    wins: int = 0
+    mafia_wins: int = 0
+    achievements: List[str] = field(default_factory=list)
+    items: Dict[str, int] = field(default_factory=dict)
+    balance: int = 1000
+    money: int = 0
+    gems: int = 0
+    protection: int = 0
+    fake_id: int = 0
+    username: Optional[str] = None
+    # Keys written by older code that have no field yet
+    extra: Dict[str, Any] = field(default_factory=dict)
+    # to_dict() as the store last had it; set by ProfileCache in additive mode
+    _stored: Optional[Dict] = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PlayerProfile":
+        profile = cls()
+        profile.update(data)
+        return profile
+
+    def to_dict(self) -> Dict:
+        data = {name: copy.deepcopy(getattr(self, name)) for name in _STORED_FIELDS}
+        extra = copy.deepcopy(self.extra)
+        if data["username"] is None:
+            del data["username"]
+        return {**extra, **data}
+
+    def _field(self, key: str) -> Optional[str]:
+        key = ALIASES.get(key, key)
+        return key if key in _FIELD_NAMES else None
+
+    def __getitem__(self, key: str):
+        name = self._field(key)
+        if name is not None:
+            return getattr(self, name)
+        return self.extra[key]
+
+    def __setitem__(self, key: str, value):
+        name = self._field(key)
+        if name is not None:
+            setattr(self, name, value)
+        else:
+            self.extra[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return self._field(key) is not None or key in self.extra
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key: str, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, data: Dict):
+        for key, value in data.items():
+            self[key] = copy.deepcopy(value)
+
+    def merge(self, data: Dict):
+        """Fold in stats kept elsewhere: counters take the larger value, lists/dicts are combined"""
+        for key, value in data.items():
+            current = self.get(key)
+            if isinstance(current, list) and isinstance(value, list):
+                current.extend(v for v in value if v not in current)
+            elif isinstance(current, dict) and isinstance(value, dict):
+                for k, v in value.items():
+                    current[k] = max(current.get(k, 0), v)
+            elif isinstance(current, int) and isinstance(value, int):
+                self[key] = max(current, value)
+            elif current is None:
+                self[key] = copy.deepcopy(value)
+
+
+# Fields written to the store, in declaration order
+_STORED_FIELDS = tuple(f.name for f in fields(PlayerProfile) if f.name not in ("extra", "_stored"))
+_FIELD_NAMES = set(_STORED_FIELDS)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def profile_changes(old: Dict, new: Dict) -> Dict:
+    """What changed between two to_dict() results, for apply_changes().
+
+    Counters become increments, lists the items added and dicts of
+    counters (shop items) per-key increments, a key dropped counting as
+    0; anything else is the new value.
+    """
+    changes = {}
+    for key, value in new.items():
+        before = old.get(key)
+        if value == before:
+            continue
+        if _is_number(value) and (before is None or _is_number(before)):
+            changes[key] = ["add", value - (before or 0)]
+        elif isinstance(value, list) and isinstance(before, (list, type(None))):
+            changes[key] = ["append", [v for v in value if v not in (before or ())]]
+        elif (isinstance(value, dict) and isinstance(before, (dict, type(None)))
+              and all(_is_number(v) for v in value.values())):
+            before = before or {}
+            changes[key] = ["add_each", {k: value.get(k, 0) - before.get(k, 0) for k in {**before, **value}
+                                         if value.get(k, 0) != before.get(k, 0)}]
+        else:
+            changes[key] = ["set", value]
+    return changes
+
+
+def apply_changes(row: Optional[Dict], changes: Dict) -> Dict:
+    """Stored profile ``row`` (None for a new player) with ``changes`` added in"""
+    data = PlayerProfile.from_dict(row or {}).to_dict()
+    for key, (op, value) in changes.items():
+        current = data.get(key)
+        if op == "add":
+            data[key] = (current if _is_number(current) else 0) + value
+        elif op == "append":
+            if not isinstance(current, list):
+                current = data[key] = []
+            current.extend(v for v in value if v not in current)
+        elif op == "add_each":
+            if not isinstance(current, dict):
+                current = data[key] = {}
+            for k, v in value.items():
+                current[k] = current.get(k, 0) + v
+                if not current[k]:
+                    del current[k]
+        else:
+            data[key] = value
+    return data
+
+
+class ProfileCache:
+    """In-memory profiles in front of the user store.
+
+    ``store`` is a callable returning the UserStore (opened lazily).
+    ``on_save(user_id, profile)`` runs after each write, e.g. to update the
+    leaderboard. Least recently used profiles are dropped past ``max_size``;
+    they are reloaded from the store on the next access. A profile handed
+    out by get() since its last save is written back when it is dropped,
+    so changes made to it before an eviction are not lost.
+
+    With ``additive`` (several processes caching the same users), a write
+    sends only what changed since the profile was loaded or last written
+    and the store adds it to its current row (profile_changes and
+    apply_changes), so points and stats earned in another process are
+    kept. The cached copy does not see those until it is reloaded.
+    """
+
+    def __init__(self, store: Callable[[], Any], max_size: int = 50000,
+                 on_save: Optional[Callable[[int, PlayerProfile], None]] = None,
+                 additive: bool = False):
+        self._store = store
+        self.max_size = max_size
+        self._on_save = on_save
+        self.additive = additive
+        self._profiles: "OrderedDict[int, PlayerProfile]" = OrderedDict()
+        # Ids handed out by get() and not saved since
+        self._unsaved = set()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, username: Optional[str] = None) -> PlayerProfile:
+        """The profile for ``user_id``, created with defaults if the player is new.
+
+        ``username`` is the player's current Telegram name, when the caller
+        has it; it is stored if it changed so rankings can show it.
+        """
+        user_id = int(user_id)
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is not None:
+                self._profiles.move_to_end(user_id)
+        created = False
+        if profile is None:
+            data = self._store().get(user_id)
+            created = data is None
+            profile = PlayerProfile() if created else PlayerProfile.from_dict(data)
+            if self.additive:
+                profile._stored = PlayerProfile().to_dict() if created else profile.to_dict()
+            evicted = {}
+            with self._lock:
+                # Another thread may have loaded it meanwhile; keep the first copy
+                profile = self._profiles.setdefault(user_id, profile)
+                self._profiles.move_to_end(user_id)
+                while len(self._profiles) > self.max_size:
+                    old_id, old_profile = self._profiles.popitem(last=False)
+                    if old_id in self._unsaved:
+                        self._unsaved.discard(old_id)
+                        evicted[old_id] = old_profile
+            if evicted:
+                self.write(evicted)
+        renamed = bool(username) and profile.username != username
+        if renamed:
+            profile.username = username
+        if created or renamed:
+            self.save(user_id)
+        with self._lock:
+            # The caller may change it from here on
+            self._unsaved.add(user_id)
+        return profile
+
+    def peek(self, user_id: int) -> Optional[PlayerProfile]:
+        """The cached profile, without loading or creating one"""
+        with self._lock:
+            return self._profiles.get(int(user_id))
+
+    def save(self, user_id: int):
+        self.save_many([user_id])
+
+    def save_many(self, user_ids: Iterable[int]):
+        """Persist profiles in one store write.
+
+        Ids no longer cached are skipped: their profile was written back
+        when it was evicted.
+        """
+        rows = {}
+        with self._lock:
+            for user_id in user_ids:
+                profile = self._profiles.get(int(user_id))
+                if profile is not None:
+                    rows[int(user_id)] = profile
+                    self._unsaved.discard(int(user_id))
+        self.write(rows)
+
+    def write(self, rows: Dict[int, PlayerProfile]):
+        """Persist the given profiles in one store write, cached or not"""
+        if not rows:
+            return
+        if self.additive:
+            changes = {}
+            for uid, profile in rows.items():
+                data = profile.to_dict()
+                changed = profile_changes(profile._stored or PlayerProfile().to_dict(), data)
+                profile._stored = data
+                if changed:
+                    changes[uid] = changed
+            if changes:
+                self._store().update_many(changes, apply_changes)
+        else:
+            self._store().put_many({uid: profile.to_dict() for uid, profile in rows.items()})
+        if self._on_save:
+            for uid, profile in rows.items():
+                self._on_save(uid, profile)
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+            self._unsaved.clear()
@@ -0,0 +1,101 @@
+"""
+Room Reaper
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import heapq
+import time
+from typing import Dict, List, Optional
+
+
+class ExpiryIndex:
+    """Room ids ordered by when they expire.
+
+    touch() pushes a new heap entry instead of updating the old one; stale
+    entries are recognised (and dropped) when they reach the top, and the
+    heap is rebuilt if they ever outnumber the live ones.
+    """
+
+    def __init__(self):
+        self._heap: List[tuple] = []
+        self._expires: Dict[int, float] = {}
+
+    def __len__(self):
+        return len(self._expires)
+
+    def __contains__(self, room_id):
+        return room_id in self._expires
+
+    def touch(self, room_id, expires_at: float):
+        self._expires[room_id] = expires_at
+        heapq.heappush(self._heap, (expires_at, room_id))
+        if len(self._heap) > 2 * len(self._expires) + 64:
+            self._heap = [(when, rid) for rid, when in self._expires.items()]
+            heapq.heapify(self._heap)
+
+    def discard(self, room_id):
+        self._expires.pop(room_id, None)
+
+    def expires_at(self, room_id) -> Optional[float]:
+        return self._expires.get(room_id)
+
+    def pop_expired(self, now: float) -> List[int]:
+        """Remove and return every room id whose expiry is at or before ``now``"""
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            when, room_id = heapq.heappop(self._heap)
+            if self._expires.get(room_id) == when:
+                del self._expires[room_id]
+                expired.append(room_id)
+        return expired
+
+
+class RoomReaper:
+    """Decides when idle or finished rooms are removed.
+
+    Rooms report activity with touch(); how long a room may stay idle
+    depends on its state: a lobby, a running game, or a finished game
+    (kept only briefly so final messages can still be sent).
+    """
+
+    def __init__(self, lobby_ttl: float = 1800, game_ttl: float = 7200, ended_ttl: float = 60):
+        self.lobby_ttl = lobby_ttl
+        self.game_ttl = game_ttl
+        self.ended_ttl = ended_ttl
+        self.index = ExpiryIndex()
+        self.reaped = 0
+
+    def ttl_for(self, room) -> float:
+        if getattr(room, "phase", None) == "ended":
+            return self.ended_ttl
+        if getattr(room, "is_joining", False) or getattr(room, "phase", None) in ("setup", "waiting"):
+            return self.lobby_ttl
+        return self.game_ttl
+
+    def touch(self, room, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        room.last_activity = now
+        self.index.touch(room.id, now + self.ttl_for(room))
+
+    def forget(self, room_id):
+        self.index.discard(room_id)
+
+    def due(self, rooms, now: Optional[float] = None) -> List[int]:
+        """Ids of rooms in ``rooms`` (id -> Room) that have expired.
+
+        Rooms no longer in ``rooms`` are dropped from the index; rooms
+        whose state changed since their last touch are re-filed.
+        """
+        now = time.time() if now is None else now
+        expired = []
+        for room_id in self.index.pop_expired(now):
+            room = rooms.get(room_id)
+            if room is None:
+                continue
+            expires_at = getattr(room, "last_activity", now) + self.ttl_for(room)
+            if expires_at > now:
+                self.index.touch(room_id, expires_at)
+            else:
+                expired.append(room_id)
+        return expired
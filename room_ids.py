@@ -0,0 +1,134 @@
+"""
+Room ID Allocator
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import hashlib
+import random
+import threading
+from typing import Callable, Optional
+
+# Digits of the room ids handed out, shortest first
+ID_TIERS = (5, 6)
+
+
+class FeistelPermutation:
+    """Keyed bijection on ``range(size)``.
+
+    A balanced Feistel network permutes the smallest even-width bit range
+    covering ``size``; values that land outside ``range(size)`` are fed
+    through again (cycle walking), which keeps the mapping one-to-one.
+    """
+
+    def __init__(self, size: int, key: int, rounds: int = 4):
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        bits += bits % 2
+        self._half = bits // 2
+        self._mask = (1 << self._half) - 1
+        self._key = key.to_bytes(16, "big")
+        self._rounds = rounds
+
+    def _round(self, r: int, value: int) -> int:
+        digest = hashlib.blake2b((r << 32 | value).to_bytes(8, "big"), digest_size=8, key=self._key).digest()
+        return int.from_bytes(digest, "big") & self._mask
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self._half, value & self._mask
+        for r in range(self._rounds):
+            left, right = right, left ^ self._round(r, right)
+        return (left << self._half) | right
+
+    def __call__(self, value: int) -> int:
+        value = self._encrypt(value)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+
+class RoomIdAllocator:
+    """Hands out unique, short room ids.
+
+    A counter shared through the store is mapped through a keyed
+    permutation of the 5-digit ids, then of the 6-digit ids, and wraps
+    around after that, so ids look random and do not repeat within a
+    cycle of 990,000 rooms. Counter values are leased from the store
+    ``block`` at a time: processes sharing a store never get the same
+    id, and the store is only touched once per block. ``is_taken`` lets
+    the caller skip ids still in use after a wrap (or from before the
+    allocator existed).
+
+    With ``submit`` (see persistence.PersistenceWorker), the next block is
+    leased in the background once half of the current one is used, so
+    allocate() does not wait on the store's lock; prefetch() leases the
+    first one ahead of time.
+    """
+
+    COUNTER = "room_id"
+    KEY = "room_id_key"
+
+    def __init__(self, store_factory: Callable, block: int = 64, tiers=ID_TIERS,
+                 submit: Optional[Callable] = None):
+        self._store_factory = store_factory
+        self._store = None
+        self._store_lock = threading.Lock()
+        self._submit = submit
+        # Future of the next block's first counter value, when one is on its way
+        self._pending = None
+        self.block = block
+        # (first id, number of ids) per tier
+        self._tiers = [(10 ** (digits - 1), 9 * 10 ** (digits - 1)) for digits in tiers]
+        self.cycle = sum(count for _, count in self._tiers)
+        self._permutations = []
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _ensure_store(self):
+        with self._store_lock:
+            if self._store is None:
+                store = self._store_factory()
+                # Every process must use the same key, so it lives in the store too
+                key = store.setdefault(self.KEY, random.SystemRandom().getrandbits(62))
+                self._permutations = [FeistelPermutation(count, key + i) for i, (_, count) in enumerate(self._tiers)]
+                self._store = store
+            return self._store
+
+    def _lease(self) -> int:
+        return self._ensure_store().lease(self.COUNTER, self.block)
+
+    def prefetch(self):
+        """Start leasing the next block in the background, unless one is on its way"""
+        if self._submit is not None and self._pending is None:
+            self._pending = self._submit(self._lease)
+
+    def _next_block(self) -> int:
+        if self._pending is None:
+            return self._lease()
+        pending, self._pending = self._pending, None
+        # Usually done already; otherwise wait for the worker rather than lease twice
+        return pending.result()
+
+    def id_for(self, position: int) -> int:
+        """Room id for counter value ``position``"""
+        self._ensure_store()
+        position %= self.cycle
+        for (first, count), permutation in zip(self._tiers, self._permutations):
+            if position < count:
+                return first + permutation(position)
+            position -= count
+
+    def allocate(self, is_taken: Optional[Callable[[int], bool]] = None) -> int:
+        with self._lock:
+            for _ in range(self.cycle):
+                if self._next >= self._end:
+                    self._next = self._next_block()
+                    self._end = self._next + self.block
+                room_id = self.id_for(self._next)
+                self._next += 1
+                if self._end - self._next <= self.block // 2:
+                    self.prefetch()
+                if is_taken is None or not is_taken(room_id):
+                    return room_id
+        raise RuntimeError("No free room ids")
@@ -4,42 +4,128 @@ Created by @berlinnad
 Copyright (c) 2024 Berlinnad. All rights reserved.
 """
 
+import asyncio
+import copy
 import random
 import time
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from game_state import BOT_NAMES, GAME_GIFS, game_data
+from database import save_database, record, get_counter_store, worker as persistence_worker
+from journal import SEQ_KEY
+from snapshot_codec import register_type
+from roster import Roster, PlayerRecord
+from timer_wheel import Countdown, wheel as timer_wheel
+from lobby_renderer import LobbyRenderer, MessageRef
+from outbox import LOW
+from reaper import ExpiryIndex, RoomReaper
+from hibernation import RoomHibernator
+from room_ids import RoomIdAllocator
+from router import CallbackData, room_nonces
 
 class Room:
     def __init__(self, creator_id, chat_id):
-        self.id = random.randint(10000, 99999)
+        self.id = _allocate_room_id()
         self.creator_id = creator_id
         self.chat_id = chat_id
-        self.players = []
+        self.players = Roster()
         self.phase = "setup"
         self.mode = None
         self.bot_count = 0
         self.join_timer = 60
         self.is_joining = True
         self.start_time = time.time()
+        self.last_activity = self.start_time
+        self.votes = {}
+
+    @property
+    def phase(self):
+        return self._phase
+
+    @phase.setter
+    def phase(self, value):
+        changed = getattr(self, "_phase", None) != value
+        self._phase = value
+        if changed:
+            # Buttons sent in the previous phase stop working (router.room_nonces)
+            self.button_nonce = random.getrandbits(16)
+            room_nonces.set(self.id, self.button_nonce)
+        if changed and self.id in active_rooms:
+            record("room_updated", self.id, fields={"phase": value, "button_nonce": self.button_nonce})
+            self.touch()
+
+    @property
+    def is_joining(self):
+        return self._is_joining
+
+    @is_joining.setter
+    def is_joining(self, value):
+        changed = getattr(self, "_is_joining", None) != value
+        self._is_joining = value
+        if changed and self.id in active_rooms:
+            record("room_updated", self.id, fields={"is_joining": value})
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, value):
+        changed = getattr(self, "_mode", None) != value
+        self._mode = value
+        if changed and self.id in active_rooms:
+            record("room_updated", self.id, fields={"mode": value})
+
+    @property
+    def bot_count(self):
+        return self._bot_count
+
+    @bot_count.setter
+    def bot_count(self, value):
+        changed = getattr(self, "_bot_count", None) != value
+        self._bot_count = value
+        if changed and self.id in active_rooms:
+            record("room_updated", self.id, fields={"bot_count": value})
+
+    def touch(self):
+        """Note activity so the reaper and the hibernator keep the room around"""
+        if self.id in active_rooms:
+            room_reaper.touch(self)
+            room_hibernator.touch(self)
 
     def add_player(self, user_id, username, is_bot=False, is_admin=False):
-        if any(p["id"] == user_id for p in self.players):
+        if user_id in self.players:
             return False, "⚠️ Already joined!"
 
-        self.players.append({
-            "id": user_id,
-            "name": username,
-            "role": None,
-            "is_bot": is_bot,
-            "is_alive": True,
-            "is_admin": is_admin
-        })
+        player = self.players.add(PlayerRecord(user_id, username, is_bot=is_bot, is_admin=is_admin))
+        active_rooms.index_player(self, user_id)
+        record("player_joined", self.id, player=player.to_dict())
+        lobby_renderer.request(self.id)
+        self.touch()
         return True, "✅ Successfully joined!"
 
     def remove_player(self, user_id):
-        self.players = [p for p in self.players if p["id"] != user_id]
+        self.players.remove(user_id)
+        active_rooms.unindex_player(self, user_id)
+        record("player_left", self.id, player_id=user_id)
+        lobby_renderer.request(self.id)
+        self.touch()
         return len(self.players) == 0
 
+    def set_role(self, player, role):
+        player["role"] = role
+        record("role_assigned", self.id, player_id=player["id"], role=role)
+        self.touch()
+
+    def cast_vote(self, voter_id, target_id):
+        self.votes[voter_id] = target_id
+        record("vote_cast", self.id, voter_id=voter_id, target_id=target_id)
+        self.touch()
+
+    def kill_player(self, player):
+        player["is_alive"] = False
+        record("player_died", self.id, player_id=player["id"])
+        self.touch()
+
     def can_start(self):
         return len(self.players) >= 4
 
@@ -55,7 +141,10 @@ class Room:
         self.buttons_visible = True  # Add flag for button visibility
 
         # Reset player states
-        self.players = []
+        for p in self.players:
+            active_rooms.unindex_player(self, p["id"])
+        self.players.clear()
+        record("room_updated", self.id, fields={"players": []})
         # Add creator as first player
         self.add_player(self.creator_id, None, is_admin=True)
 
@@ -77,30 +166,346 @@ class Room:
             mentions.append(f"@{creator['name']}")
 
         # Add bots with proper formatting
-        for p in self.players:
-            if p.get('is_bot', False):
-                mentions.append(f"🤖 Bot {p['name']}")
+        for p in self.players.bots():
+            mentions.append(f"🤖 Bot {p['name']}")
 
         # Add other real players
-        for p in self.players:
-            if not p.get('is_bot', False) and not p.get('is_admin', False):
+        for p in self.players.humans():
+            if not p.get('is_admin', False):
                 mentions.append(f"@{p['name']}")
 
         return mentions
 
     def get_alive_players(self):
-        return [p for p in self.players if p["is_alive"]]
-
-
-active_rooms = {}
+        return self.players.alive()
+
+    def to_dict(self):
+        """Plain room state for snapshots; runtime-only attributes start with '_'"""
+        state = {k: v for k, v in vars(self).items() if not k.startswith("_")}
+        state["phase"] = self._phase
+        state["is_joining"] = self._is_joining
+        state["mode"] = self._mode
+        state["bot_count"] = self._bot_count
+        state["players"] = self.players.to_list()
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        """Room from to_dict() output or a journaled game_data room entry"""
+        room = cls.__new__(cls)
+        state = dict(state)
+        room._phase = state.pop("phase", "setup")
+        room._is_joining = state.pop("is_joining", room._phase in ("setup", "waiting"))
+        # Journaled entries only carry what the journal operations record
+        state.setdefault("start_time", state.get("created_at", time.time()))
+        state.setdefault("last_activity", state["start_time"])
+        state.setdefault("join_timer", 60)
+        room._mode = state.pop("mode", None)
+        room._bot_count = state.pop("bot_count", 0)
+        if state.get("button_nonce") is None:
+            state["button_nonce"] = random.getrandbits(16)
+        room.__dict__.update(state)
+        room_nonces.set(room.id, room.button_nonce)
+        room.players = Roster(state.get("players", ()))
+        # JSON snapshots turn the voter ids into strings
+        room.votes = {int(k) if isinstance(k, str) and k.lstrip("-").isdigit() else k: v
+                      for k, v in state.get("votes", {}).items()}
+        return room
+
+
+register_type("room", Room, Room.to_dict, Room.from_dict)
+
+
+class RoomRegistry(dict):
+    """room_id -> Room, with chat_id and player_id indexes kept in step.
+
+    Rooms report player changes through index_player/unindex_player
+    (Room.add_player, remove_player and setup do), so lookups by chat or
+    player never scan the rooms. Index values are insertion-ordered
+    dicts used as sets: the first entry is the oldest room.
+
+    Hibernated rooms are not in the dict but stay in the indexes; the
+    lookups hand their ids to ``waker``, which brings them back.
+
+    ``observer(player_id, room_id, present)``, when set, is called as
+    players enter and leave the player index (sharding.py workers report
+    this to the front process).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._by_chat = {}
+        self._by_player = {}
+        # room_id -> (chat key, player ids) of hibernated rooms
+        self._hibernated = {}
+        self.waker = None
+        self.observer = None
+
+    def _add(self, index, key, room_id):
+        room_ids = index.setdefault(key, {})
+        if room_id not in room_ids:
+            room_ids[room_id] = None
+            if index is self._by_player and self.observer is not None:
+                self.observer(key, room_id, True)
+
+    def _discard(self, index, key, room_id):
+        room_ids = index.get(key)
+        if room_ids is not None and room_id in room_ids:
+            del room_ids[room_id]
+            if not room_ids:
+                del index[key]
+            if index is self._by_player and self.observer is not None:
+                self.observer(key, room_id, False)
+
+    def __setitem__(self, room_id, room):
+        if room_id in self:
+            self._unindex(self[room_id])
+        self._forget_hibernated(room_id)
+        super().__setitem__(room_id, room)
+        self._add(self._by_chat, str(room.chat_id), room_id)
+        for p in room.players:
+            self._add(self._by_player, p["id"], room_id)
+
+    def __delitem__(self, room_id):
+        self._unindex(self[room_id])
+        super().__delitem__(room_id)
+
+    def pop(self, room_id, *default):
+        if room_id in self:
+            self._unindex(self[room_id])
+        else:
+            self._forget_hibernated(room_id)
+        return super().pop(room_id, *default)
+
+    def clear(self):
+        super().clear()
+        self._by_chat.clear()
+        self._by_player.clear()
+        self._hibernated.clear()
+
+    def hibernate(self, room_id):
+        """Drop the Room object of ``room_id`` but keep it in the indexes"""
+        room = super().pop(room_id)
+        self._hibernated[room_id] = (str(room.chat_id), room.players.ids())
+        return room
+
+    def add_hibernated(self, room_id, chat_id, player_ids):
+        """Index a room that is only in the persisted state"""
+        self._forget_hibernated(room_id)
+        self._hibernated[room_id] = (str(chat_id), list(player_ids))
+        self._add(self._by_chat, str(chat_id), room_id)
+        for player_id in player_ids:
+            self._add(self._by_player, player_id, room_id)
+
+    def is_hibernated(self, room_id):
+        return room_id in self._hibernated
+
+    @property
+    def hibernated_count(self):
+        return len(self._hibernated)
+
+    def _forget_hibernated(self, room_id):
+        keys = self._hibernated.pop(room_id, None)
+        if keys is not None:
+            chat_key, player_ids = keys
+            self._discard(self._by_chat, chat_key, room_id)
+            for player_id in player_ids:
+                self._discard(self._by_player, player_id, room_id)
+
+    def _unindex(self, room):
+        self._discard(self._by_chat, str(room.chat_id), room.id)
+        for p in room.players:
+            self._discard(self._by_player, p["id"], room.id)
+
+    def _registered(self, room):
+        return super().get(room.id) is room
+
+    def index_player(self, room, player_id):
+        if self._registered(room):
+            self._add(self._by_player, player_id, room.id)
+
+    def unindex_player(self, room, player_id):
+        if self._registered(room):
+            self._discard(self._by_player, player_id, room.id)
+
+    def _resolve(self, room_ids):
+        rooms = []
+        # Waking a room re-indexes it, so iterate over a copy
+        for room_id in list(room_ids):
+            room = super().get(room_id)
+            if room is None and self.waker is not None:
+                room = self.waker(room_id)
+            if room is not None:
+                rooms.append(room)
+        return rooms
+
+    def rooms_for_player(self, player_id):
+        return self._resolve(self._by_player.get(player_id, ()))
+
+    def rooms_for_chat(self, chat_id):
+        return self._resolve(self._by_chat.get(str(chat_id), ()))
+
+
+active_rooms = RoomRegistry()
+
+# Unique short room ids, shared with other processes through the SQLite store;
+# blocks are leased on the persistence worker
+room_ids = RoomIdAllocator(get_counter_store, submit=persistence_worker.submit)
+
+def _room_id_taken(room_id):
+    return (room_id in active_rooms or active_rooms.is_hibernated(room_id)
+            or str(room_id) in game_data.get("active_rooms", {}))
+
+def _allocate_room_id():
+    return room_ids.allocate(is_taken=_room_id_taken)
+
+# Expires idle and finished rooms, see reap_rooms()
+room_reaper = RoomReaper()
+
+# Moves idle rooms out of memory, see hibernate_rooms()
+room_hibernator = RoomHibernator()
+
+# room_id -> running asyncio tasks of that room (game loop)
+room_tasks = {}
+
+# room_id -> timer handles from schedule_room_deadline()
+room_deadlines = {}
+
+# Functions called with the room id whenever a room is deleted
+_room_cleanups = []
+
+def on_room_deleted(callback):
+    """Register ``callback(room_id)`` to drop per-room state kept elsewhere"""
+    _room_cleanups.append(callback)
+    return callback
 
 def create_room(creator_id, chat_id):
     room = Room(creator_id, chat_id)
     active_rooms[room.id] = room
+    record("room_created", room.id, chat_id=chat_id, creator_id=creator_id, button_nonce=room.button_nonce)
+    room.touch()
     return room
 
+def delete_room(room_id, save=True):
+    """Remove a room from memory and from the persisted state"""
+    room_id = int(room_id)
+    hibernated = active_rooms.is_hibernated(room_id)
+    room = active_rooms.pop(room_id, None)
+    cancel_room_timer(room_id)
+    room_reaper.forget(room_id)
+    room_hibernator.forget(room_id)
+    room_nonces.forget(room_id)
+    cancel_room_tasks(room_id)
+    for handle in room_deadlines.pop(room_id, ()):
+        handle.cancel()
+    for callback in _room_cleanups:
+        callback(room_id)
+    record("room_deleted", room_id, save=save)
+    return room is not None or hibernated
+
+def track_room_task(room_id, coro):
+    """Run ``coro`` as a task the reaper can cancel along with its room"""
+    task = asyncio.get_running_loop().create_task(coro)
+    tasks = room_tasks.setdefault(room_id, set())
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return task
+
+def schedule_room_deadline(room_id, delay, callback, *args):
+    """Call ``callback(room_id, *args)`` after ``delay`` seconds on the timer wheel.
+
+    Unlike a sleeping task this holds no reference to the Room, so the
+    room may hibernate in the meantime; the callback's get_room() wakes
+    it. Pending deadlines are cancelled when the room is deleted.
+    """
+    handles = [h for h in room_deadlines.get(room_id, ()) if not h.cancelled]
+    handles.append(timer_wheel.schedule(delay, callback, room_id, *args))
+    room_deadlines[room_id] = handles
+    return handles[-1]
+
+def cancel_room_tasks(room_id):
+    """Cancel the tasks tracked for ``room_id``, except the one calling this"""
+    current = asyncio.current_task() if _loop_running() else None
+    for task in room_tasks.pop(room_id, ()):
+        if task is not current:
+            task.cancel()
+
+def _loop_running():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
 def get_room(room_id):
-    return active_rooms.get(room_id)
+    room = active_rooms.get(room_id)
+    if room is None and active_rooms.is_hibernated(room_id):
+        room = _wake_room(room_id)
+    return room
+
+def _wake_room(room_id):
+    """Rebuild a hibernated room from its persisted state"""
+    state = game_data.get("active_rooms", {}).get(str(room_id))
+    if state is None or not active_rooms.is_hibernated(room_id):
+        return None
+    # Copy so the live room shares nothing with the persisted dict
+    state = copy.deepcopy(state)
+    state.pop("hibernated", None)
+    room = Room.from_dict(state)
+    active_rooms[room_id] = room
+    _persisted_only_rooms().discard(room_id)
+    room_reaper.index.touch(room_id, room.last_activity + room_reaper.ttl_for(room))
+    # A lookup is not activity for the reaper, but keeps the room awake for a while
+    room_hibernator.postpone(room_id)
+    room_hibernator.woken += 1
+    record("room_updated", room_id, fields={"hibernated": False})
+    return room
+
+active_rooms.waker = _wake_room
+
+def _pinned(room_id):
+    """Whether something outside the registry still holds the Room"""
+    return bool(room_tasks.get(room_id)) or room_id in room_countdowns
+
+def hibernate_rooms(now=None):
+    """Move rooms idle for room_hibernator.idle_after seconds out of memory.
+
+    The full room state goes to game_data["active_rooms"] through the
+    journal, and the Room object is dropped; get_room() and the chat and
+    player lookups wake it on the next access, and deadlines scheduled
+    with schedule_room_deadline() still fire. Rooms with a running task
+    or join countdown stay in memory. Returns the ids put to sleep.
+    """
+    now = time.time() if now is None else now
+    sleeping = []
+    for room_id in room_hibernator.due(active_rooms, now):
+        if _pinned(room_id):
+            room_hibernator.postpone(room_id, now)
+            continue
+        room = active_rooms[room_id]
+        state = copy.deepcopy(room.to_dict())
+        state["hibernated"] = True
+        record("room_updated", room_id, save=False, fields=state)
+        active_rooms.hibernate(room_id)
+        room_tasks.pop(room_id, None)
+        # Hibernated rooms expire like the ones left over from a restart
+        room_reaper.forget(room_id)
+        _persisted_only_rooms().touch(room_id, room.last_activity + room_reaper.ttl_for(room))
+        sleeping.append(room_id)
+    if sleeping:
+        room_hibernator.hibernated += len(sleeping)
+        save_database(game_data, keys=[SEQ_KEY], room_ids=sleeping)
+    return sleeping
+
+async def hibernate_rooms_job(context):
+    """JobQueue callback running hibernate_rooms()"""
+    try:
+        sleeping = hibernate_rooms()
+        if sleeping:
+            print(f"Hibernated {len(sleeping)} idle rooms "
+                  f"({len(active_rooms)} in memory, {active_rooms.hibernated_count} hibernated)")
+    except Exception as e:
+        print(f"Error hibernating rooms: {e}")
 
 def save_room_to_db(room):
     try:
@@ -108,218 +513,252 @@ def save_room_to_db(room):
         game_data["active_rooms"][str(room.id)] = {
             "creator_id": room.creator_id,
             "mode": room.mode,
-            "players": room.players,
+            "players": room.players.to_list(),
             "bot_count": room.bot_count,
             "created_at": time.time()
         }
-        save_database(game_data)
+        save_database(game_data, room_id=room.id)
     except Exception as e:
         print(f"Error saving room to database: {e}")
 
+# Rooms in the persisted state but not in memory (hibernated, or left over
+# from before a restart)
+_persisted_only = None
+
+def _persisted_only_rooms():
+    global _persisted_only
+    if _persisted_only is None:
+        _persisted_only = ExpiryIndex()
+        for room_id, room in game_data.get("active_rooms", {}).items():
+            if int(room_id) not in active_rooms:
+                last_activity = room.get("last_activity", room.get("created_at", 0))
+                _persisted_only.touch(int(room_id), last_activity + room_reaper.lobby_ttl)
+    return _persisted_only
+
+def reap_rooms(now=None):
+    """Delete rooms idle past their TTL and persist the deletions in one save.
+
+    Only rooms at the front of the expiry index are looked at, so the
+    cost does not grow with the number of live rooms. Returns the ids of
+    the deleted rooms.
+    """
+    now = time.time() if now is None else now
+    expired = room_reaper.due(active_rooms, now)
+    expired += [room_id for room_id in _persisted_only_rooms().pop_expired(now)
+                if room_id not in active_rooms]
+    for room_id in expired:
+        delete_room(room_id, save=False)
+    if expired:
+        room_reaper.reaped += len(expired)
+        save_database(game_data, keys=[SEQ_KEY], room_ids=expired)
+    return expired
+
+async def reap_rooms_job(context):
+    """JobQueue callback running reap_rooms()"""
+    try:
+        expired = reap_rooms()
+        if expired:
+            print(f"Reaped {len(expired)} inactive rooms")
+    except Exception as e:
+        print(f"Error reaping rooms: {e}")
+
 def cleanup_inactive_rooms():
-    current_time = time.time()
-    if "active_rooms" in game_data:
-        for room_id in list(game_data["active_rooms"].keys()):
-            room = game_data["active_rooms"][room_id]
-            # Remove room if no real players for 30 minutes
-            if current_time - room["created_at"] > 1800 and not any(not p.get("is_bot", False) for p in room["players"]):
-                del game_data["active_rooms"][room_id]
-                if room_id in active_rooms:
-                    del active_rooms[room_id]
-        save_database(game_data)
+    return reap_rooms()
 
 def cleanup_user_rooms(user_id, chat_id):
-    for room_id in list(active_rooms.keys()):
-        room = active_rooms[room_id]
+    candidates = {room.id: room for room in active_rooms.rooms_for_chat(chat_id)}
+    candidates.update((room.id, room) for room in active_rooms.rooms_for_player(user_id))
+    for room_id, room in candidates.items():
         if (room.creator_id == user_id and room.chat_id == chat_id) or \
-           (not room.is_joining and any(p["id"] == user_id for p in room.players)):
-            del active_rooms[room_id]
+           (not room.is_joining and user_id in room.players):
+            delete_room(room_id)
 
 def get_room_by_player(player_id):
-    for room_id, room in list(active_rooms.items()):
-        if any(p["id"] == player_id for p in room.players):
-            return room
-    return None
+    rooms = active_rooms.rooms_for_player(player_id)
+    return rooms[0] if rooms else None
 
 def get_room_by_chat(chat_id):
-    for room in active_rooms.values():
-        if str(room.chat_id) == str(chat_id):
-            return room
-    return None
+    rooms = active_rooms.rooms_for_chat(chat_id)
+    return rooms[0] if rooms else None
 
 async def get_room_keyboard(room, user_id):
     try:
         if room and room.is_joining:
             # Only show join button if user is not already in room
-            if not any(p["id"] == user_id for p in room.players):
+            if user_id not in room.players:
                 return InlineKeyboardMarkup([[
-                    InlineKeyboardButton("🔗 Join Room", callback_data=f"join_room_{room.id}")
+                    InlineKeyboardButton("🔗 Join Room", callback_data=CallbackData("join_room", room.id).encode())
                 ]])
         return InlineKeyboardMarkup([])
     except Exception as e:
         print(f"Error creating keyboard: {e}")
         return InlineKeyboardMarkup([])
 
-def handle_room_leave(room, player_id):
-    room.remove_player(player_id)
-    real_players = [p for p in room.players if not p.get('is_bot', False)]
-
-    if len(real_players) == 0:
-        if room.id in active_rooms:
-            del active_rooms[room.id]
-        return True, "🚫 The room has been deleted because it only contained bots."
-    return False, "✅ Successfully left the room."
-
-async def handle_room_timer(room, message, context):
+# Seconds before the join deadline at which the group is reminded
+JOIN_REMINDERS = (45, 30, 15, 5)
+
+# room_id -> Countdown for rooms still accepting players
+room_countdowns = {}
+
+# Edits the lobby messages; joins, leaves and reminders only request a redraw
+lobby_renderer = LobbyRenderer(timer_wheel)
+
+def _format_lobby_players(room):
+    player_list = []
+    for p in room.players:
+        if p.get('is_admin', False):
+            player_list.append(f"👑 @{p['name']} (Admin)")
+        elif p.get('is_bot', False):
+            player_list.append(f"🤖 Bot {p['name']}")
+        else:
+            player_list.append(f"👤 @{p['name']}")
+    return player_list
+
+def render_lobby(room_id, seconds_left):
+    """Lobby text and keyboard rows for the renderer; None once joining is over"""
+    room = get_room(room_id)
+    if not room or not room.is_joining:
+        return None
+    text = (
+        f"📢 Room #{room.id}\n\n"
+        f"👥 Player ({len(room.players)}):\n"
+        f"{chr(10).join(_format_lobby_players(room))}\n\n"
+        f"⏳ {seconds_left} Seconds remaining"
+    )
+    return text, [[("➕ Bergabung", CallbackData("join_room", room.id).encode())]]
+
+def start_room_timer(room, message, context):
+    """Start the join countdown of a room on the shared timer wheel.
+
+    Replaces the per-room loop that woke every second: the wheel calls
+    back only at the reminder points and the deadline. Callbacks look the
+    room up by id, so a deleted room simply makes them no-ops.
+    """
+    if not room or not room.is_joining:
+        return None
+    if room.id in room_countdowns:
+        return room_countdowns[room.id]
+
+    room_id = room.id
+    time_left = max(0, room.join_timer - (time.time() - room.start_time))
+    # Enough to rebuild the countdown and lobby after a restart (restore_rooms)
+    room.lobby_message = [message.chat_id, message.message_id]
+    record("room_updated", room_id, fields={
+        "is_joining": room.is_joining, "start_time": room.start_time,
+        "join_timer": room.join_timer, "lobby_message": room.lobby_message
+    })
+    countdown = Countdown(
+        timer_wheel,
+        time_left,
+        on_deadline=lambda: _finish_joining(room_id, context),
+        on_reminder=lambda seconds: _remind_joining(room_id, context, seconds),
+        reminders=JOIN_REMINDERS
+    )
+    room_countdowns[room_id] = countdown
+    lobby_renderer.attach(room_id, room.chat_id, message,
+                          render=lambda seconds: render_lobby(room_id, seconds),
+                          remaining=lambda: countdown.remaining)
+    return countdown
+
+def extend_room_timer(room_id, seconds):
+    """Add ``seconds`` to a room's join time; False if it is not counting down"""
+    room = get_room(room_id)
+    countdown = room_countdowns.get(room_id)
+    if not room or not countdown or not countdown.extend(seconds):
+        return False
+    room.join_timer += seconds
+    record("room_updated", room_id, fields={"join_timer": room.join_timer})
+    return True
+
+def cancel_room_timer(room_id):
+    countdown = room_countdowns.pop(room_id, None)
+    if countdown:
+        countdown.cancel()
+    lobby_renderer.detach(room_id)
+
+async def _remind_joining(room_id, context, seconds):
+    room = get_room(room_id)
+    if not room or not room.is_joining:
+        return
     try:
-        start_time = time.time()
-        reminder_times = [45, 30, 15, 5]
-        last_update = 0
-        update_interval = 10  # Increased to avoid rate limits
-
-        while time.time() - start_time < room.join_timer and room.is_joining:
-            time_left = room.join_timer - (time.time() - start_time)
-
-            # Single join button
-            keyboard = []
-            if room.is_joining:
-                keyboard = [[InlineKeyboardButton("➕ Bergabung", callback_data=f"join_room_{room.id}")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            # Format player list
-            player_list = []
-            for p in room.players:
-                if p.get('is_admin', False):
-                    player_list.append(f"👑 @{p['name']} (Admin)")
-                elif p.get('is_bot', False):
-                    player_list.append(f"🤖 Bot {p['name']}")
-                else:
-                    player_list.append(f"👤 @{p['name']}")
-
-            current_time = time.time()
-            if current_time - last_update >= update_interval:
-                try:
-                    await message.edit_text(
-                        f"📢 Room #{room.id}\n\n"
-                        f"👥 Player ({len(room.players)}):\n"
-                        f"{chr(10).join(player_list)}\n\n"
-                        f"⏳ {int(time_left)} Seconds remaining",
-                        reply_markup=reply_markup
-                    )
-                    last_update = current_time
-                except Exception as e:
-                    if "429" in str(e):
-                        await asyncio.sleep(5)  # Longer delay on rate limit
-
-            # Send reminder if needed
-            if int(time_left) in reminder_times:
-                try:
-                    await context.bot.send_message(
-                        chat_id=room.chat_id,
-                        text=f"⏰ {int(time_left)} Seconds remaining!\n"
-                             f"👥 Total Players: {len(room.players)}"
-                    )
-                    reminder_times.remove(int(time_left))
-                except Exception as e:
-                    print(f"Error sending reminder: {e}")
-
-            # Check if timer ended
-            if time_left <= 0:
-                total_players = len(room.players)
-                real_players = len([p for p in room.players if not p.get('is_bot', False)])
-
-                # Start game if at least 4 players (including bots)
-                if total_players >= 4:
-                    room.is_joining = False
-                    from game_logic import start_game
-                    await start_game(room, context)
-                    await context.bot.send_message(
-                        chat_id=room.chat_id,
-                        text="🎮 The game will begin! Check your PM for role information."
-                    )
-                else:
-                    await context.bot.send_message(
-                        chat_id=room.chat_id,
-                        text=f"❌ Room cancelled due to insufficient players.\n"
-                             f"Minimum 4 players (including bots)\n"
-                             f"Total players: {total_players}\n\n"
-                             f"Please create a new room to play.",
-                        reply_markup=InlineKeyboardMarkup([[
-                            InlineKeyboardButton("🎮 Create a New Room", callback_data="create_room")
-                        ]])
-                    )
-                    # Cleanup room
-                    if room.id in active_rooms:
-                        del active_rooms[room.id]
-                break
-
-            await asyncio.sleep(1)
-
+        await context.bot.send_message(
+            chat_id=room.chat_id,
+            text=f"⏰ {seconds} Seconds remaining!\n"
+                 f"👥 Total Players: {len(room.players)}",
+            rate_limit_args={"priority": LOW}
+        )
+    except Exception as e:
+        print(f"Error sending reminder: {e}")
+    lobby_renderer.request(room_id)
+
+async def _finish_joining(room_id, context):
+    room_countdowns.pop(room_id, None)
+    lobby_renderer.detach(room_id)
+    room = get_room(room_id)
+    if not room or not room.is_joining:
+        return
+    try:
+        total_players = len(room.players)
+
+        # Start game if at least 4 players (including bots)
+        if total_players >= 4:
+            from game_logic import start_game
+            await start_game(room, context)
+            await context.bot.send_message(
+                chat_id=room.chat_id,
+                text="🎮 The game will begin! Check your PM for role information."
+            )
+        else:
+            await context.bot.send_message(
+                chat_id=room.chat_id,
+                text=f"❌ Room cancelled due to insufficient players.\n"
+                     f"Minimum 4 players (including bots)\n"
+                     f"Total players: {total_players}\n\n"
+                     f"Please create a new room to play.",
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🎮 Create a New Room", callback_data="create_room")
+                ]])
+            )
+            # Cleanup room
+            delete_room(room.id)
     except Exception as e:
         print(f"Error in room timer: {e}")
 
-
-def save_database(data):
-    # Replace this with your actual database saving logic
-    print(f"Saving data to database: {data}")
-
-async def handle_query(update, context):
-    query = update.callback_query
-    await query.answer()
-
-    if query.data.startswith("start_game_"):
-        try:
-            room_id = int(query.data.split("_")[2])
-            room = get_room(room_id)
-            if room and room.can_start():
-                #Start Game Logic Here.  This is a placeholder.  You'll need to implement
-                #role assignment, game start messages, and game logic.
-                await query.message.edit_text("Game Started!")
-        except Exception as e:
-            print(f"Error starting game: {e}")
-            await query.answer("❌ Failed to start the game!", show_alert=True)
-
-    elif query.data.startswith("join_room_"):
-        try:
-            room_id = int(query.data.split("_")[2])
-            room = get_room(room_id)
-            if room and room.is_joining:
-                player_id = query.from_user.id
-                player_name = query.from_user.username
-                result = room.add_player(player_id, player_name)
-                if result[0]:
-                    await query.message.edit_text(result[1])
-                else:
-                    await query.answer(result[1], show_alert=True)
-
-        except Exception as e:
-            print(f"Error joining room: {e}")
-            await query.answer("❌ Failed to join the room!", show_alert=True)
-
-
-    elif query.data.startswith("leave_room_"):
-        try:
-            room_id = int(query.data.split("_")[2])
-            room = get_room(room_id)
-            player_id = query.from_user.id
-
-            success, message = handle_room_leave(room, player_id)
-            if success:
-                await query.message.edit_text(message)
-            else:
-                await query.message.edit_text(message)
-        except Exception as e:
-            print(f"Error leaving room: {e}")
-            await query.answer("❌ Failed to leave the room!", show_alert=True)
-
-    elif query.data.startswith("cancel_room_"):
-        try:
-            room_id = int(query.data.split("_")[2])
-            room = get_room(room_id)
-            if room:
-                if room.id in active_rooms:
-                    del active_rooms[room.id]
-                await query.message.edit_text("The room has been cancelled!")
-        except Exception as e:
-            print(f"Error cancelling room: {e}")
-            await query.answer("❌ Failed to cancel the room!", show_alert=True)
+def restore_rooms(application):
+    """Rebuild the rooms of the persisted state after a restart.
+
+    Lobbies get back their join countdown (whatever was left of it,
+    counted from start_time) and keep editing their lobby message; games
+    in progress resume game_logic.handle_game_loop at the persisted phase
+    and round. Hibernated rooms stay hibernated. Must run on the event
+    loop (post_init). Returns the number of rooms restored.
+    """
+    from telegram.ext import CallbackContext
+    from game_logic import handle_game_loop
+
+    context = CallbackContext(application)
+    now = time.time()
+    restored = 0
+    for key, state in list(game_data.get("active_rooms", {}).items()):
+        room_id = int(key)
+        if room_id in active_rooms or active_rooms.is_hibernated(room_id):
+            continue
+        if state.get("hibernated"):
+            active_rooms.add_hibernated(room_id, state.get("chat_id"), [p["id"] for p in state.get("players", ())])
+            continue
+
+        state = copy.deepcopy(state)
+        state["id"] = room_id
+        room = Room.from_dict(state)
+        # The downtime does not count as idle time
+        room.last_activity = now
+        active_rooms[room_id] = room
+        room.touch()
+        restored += 1
+
+        lobby_message = getattr(room, "lobby_message", None)
+        if room.is_joining and lobby_message:
+            start_room_timer(room, MessageRef(application.bot, *lobby_message), context)
+        elif room.phase in ("night", "day", "voting"):
+            track_room_task(room_id, handle_game_loop(room, context))
+    return restored
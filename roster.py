@@ -0,0 +1,203 @@
+"""
+Room Player Roster
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+from collections.abc import Sequence
+from typing import Dict, Iterable, List, Optional
+
+
+class PlayerRecord:
+    """One player in a room.
+
+    Behaves like the player dicts it replaces (``p["id"]``,
+    ``p.get("is_bot")``, ``p["role"] = ...``). Keys without a slot go
+    to a small side dict that is only created when needed.
+    """
+
+    __slots__ = ("id", "name", "role", "is_bot", "_is_alive", "is_admin", "_roster", "_extra")
+
+    FIELDS = ("id", "name", "role", "is_bot", "is_alive", "is_admin")
+
+    def __init__(self, id, name=None, role=None, is_bot=False, is_alive=True, is_admin=False):
+        self.id = id
+        self.name = name
+        self.role = role
+        self.is_bot = is_bot
+        self._is_alive = is_alive
+        self.is_admin = is_admin
+        self._roster = None
+        self._extra = None
+
+    @property
+    def is_alive(self):
+        return self._is_alive
+
+    @is_alive.setter
+    def is_alive(self, value):
+        value = bool(value)
+        if value != self._is_alive:
+            self._is_alive = value
+            if self._roster is not None:
+                self._roster._alive_changed(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PlayerRecord":
+        record = cls(**{k: data[k] for k in cls.FIELDS if k in data})
+        for key, value in data.items():
+            if key not in cls.FIELDS:
+                record[key] = value
+        return record
+
+    def to_dict(self) -> Dict:
+        data = {k: getattr(self, k) for k in self.FIELDS}
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        return key in self.FIELDS or bool(self._extra and key in self._extra)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return f"PlayerRecord({self.to_dict()!r})"
+
+
+class Roster(Sequence):
+    """Ordered players of a room, keyed by id.
+
+    Indexing, slicing and iteration work like the old list, so
+    ``random.shuffle``/``random.sample`` and existing loops keep working.
+    ``player_id in roster`` and get() are O(1), and the alive/bot id sets
+    are kept current as players join, leave or die.
+    """
+
+    def __init__(self, players: Iterable = ()):
+        self._order: List[PlayerRecord] = []
+        self._by_id: Dict[int, PlayerRecord] = {}
+        self._alive = set()
+        self._bots = set()
+        for player in players:
+            self.add(player)
+
+    def _index(self, record: PlayerRecord):
+        record._roster = self
+        self._by_id[record.id] = record
+        if record.is_alive:
+            self._alive.add(record.id)
+        if record.is_bot:
+            self._bots.add(record.id)
+
+    def _unindex(self, record: PlayerRecord):
+        record._roster = None
+        self._by_id.pop(record.id, None)
+        self._alive.discard(record.id)
+        self._bots.discard(record.id)
+
+    def _alive_changed(self, record: PlayerRecord):
+        if record.is_alive:
+            self._alive.add(record.id)
+        else:
+            self._alive.discard(record.id)
+
+    def add(self, player) -> PlayerRecord:
+        """Append a player (record or dict); returns the stored record"""
+        record = player if isinstance(player, PlayerRecord) else PlayerRecord.from_dict(player)
+        if record.id in self._by_id:
+            raise ValueError(f"Player {record.id} is already in the roster")
+        self._order.append(record)
+        self._index(record)
+        return record
+
+    def remove(self, player_id) -> Optional[PlayerRecord]:
+        record = self._by_id.get(player_id)
+        if record is not None:
+            self._order.remove(record)
+            self._unindex(record)
+        return record
+
+    def clear(self):
+        for record in self._order:
+            record._roster = None
+        self._order.clear()
+        self._by_id.clear()
+        self._alive.clear()
+        self._bots.clear()
+
+    def get(self, player_id) -> Optional[PlayerRecord]:
+        return self._by_id.get(player_id)
+
+    def __contains__(self, item):
+        if isinstance(item, PlayerRecord):
+            return self._by_id.get(item.id) is item
+        return item in self._by_id
+
+    def __getitem__(self, index):
+        return self._order[index]
+
+    def __setitem__(self, index, record: PlayerRecord):
+        # Used by random.shuffle, which only swaps records already present
+        old = self._order[index]
+        self._order[index] = record
+        if old is not record and old not in self._order:
+            self._unindex(old)
+        self._index(record)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        # Iterate over a copy so callers may remove players while looping
+        return iter(list(self._order))
+
+    def __repr__(self):
+        return f"Roster({self._order!r})"
+
+    @property
+    def alive_count(self) -> int:
+        return len(self._alive)
+
+    @property
+    def bot_count(self) -> int:
+        return len(self._bots)
+
+    @property
+    def human_count(self) -> int:
+        return len(self._order) - len(self._bots)
+
+    def alive(self) -> List[PlayerRecord]:
+        return [p for p in self._order if p.id in self._alive]
+
+    def bots(self) -> List[PlayerRecord]:
+        return [p for p in self._order if p.id in self._bots]
+
+    def humans(self) -> List[PlayerRecord]:
+        return [p for p in self._order if p.id not in self._bots]
+
+    def ids(self) -> List[int]:
+        return [p.id for p in self._order]
+
+    def to_list(self) -> List[Dict]:
+        """Plain dicts, for snapshots and the journal"""
+        return [p.to_dict() for p in self._order]
@@ -0,0 +1,310 @@
+"""
+Callback Query Router
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import base64
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+from telegram import Update
+from telegram.ext import ContextTypes
+
+# Versions of the callback_data layouts written by CallbackData.encode()
+TEXT_VERSION = 1
+PACKED_VERSION = 2
+
+# Packed callback_data starts with this; it is not in the base64url alphabet
+PACKED_MARKER = "!"
+
+# Action byte of the packed layout. Buttons in old messages keep their
+# codes, so only ever append to this table.
+ACTION_CODES = {
+    "join_room": 1,
+    "leave_room": 2,
+    "start_game": 3,
+    "cancel_room": 4,
+    "setup_bot": 5,
+    "setup_room": 6,
+    "select_mode": 7,
+    "select_bots": 8,
+    "create_room_no_bots": 9,
+    "create_room_with_bots": 10,
+    "mode": 11,
+    "buy": 12,
+    "leaderboard": 13,
+    "kill": 14,
+    "boss_kill": 15,
+    "investigate": 16,
+    "heal": 17,
+    "lawyer_protect": 18,
+}
+ACTIONS_BY_CODE = {code: action for action, code in ACTION_CODES.items()}
+
+# Packed field flags and widths (bytes, big-endian)
+_HAS_NONCE, _HAS_ROOM, _HAS_TARGET, _HAS_ARGS = 1, 2, 4, 8
+NONCE_BYTES = 2
+ROOM_ID_BYTES = 3
+# Telegram user and chat ids have at most 52 significant bits, plus sign
+TARGET_ID_BYTES = 7
+ARG_SEPARATOR = "\x1f"
+
+# callback_data from before the codec: prefix -> (action, fields in order).
+# The last field takes the rest of the string ("buy_fake_id").
+LEGACY_PREFIXES = {
+    "join_room_": ("join_room", ("room_id",)),
+    "leave_room_": ("leave_room", ("room_id",)),
+    "start_game_": ("start_game", ("room_id",)),
+    "cancel_room_": ("cancel_room", ("room_id",)),
+    "setup_bot_": ("setup_bot", ("room_id", "arg", "arg")),
+    "setup_room_": ("setup_room", ("room_id", "arg", "arg")),
+    "select_mode_": ("select_mode", ("arg", "room_id")),
+    "select_bots_": ("select_bots", ("arg",)),
+    "create_room_no_bots_": ("create_room_no_bots", ("arg",)),
+    "create_room_with_bots_": ("create_room_with_bots", ("arg",)),
+    "mode_": ("mode", ("arg",)),
+    "buy_": ("buy", ("arg",)),
+    "leaderboard_": ("leaderboard", ("arg",)),
+    "kill_": ("kill", ("room_id", "target_id")),
+    "boss_kill_": ("boss_kill", ("room_id", "target_id")),
+    "investigate_": ("investigate", ("room_id", "target_id")),
+    "heal_": ("heal", ("room_id", "target_id")),
+    "lawyer_protect_": ("lawyer_protect", ("room_id", "target_id")),
+}
+
+# Legacy callback_data that does not decode to its own text as action
+LEGACY_ACTIONS = {
+    "leave_room": "leave",
+}
+
+
+class CallbackDataError(ValueError):
+    """callback_data that cannot be decoded"""
+
+
+@dataclass(frozen=True)
+class CallbackData:
+    """What a button asks for: an action code plus its parameters.
+
+    encode() gives the callback_data string:
+    - the bare action when there are no parameters ("main_menu");
+    - for actions in ACTION_CODES, PACKED_MARKER + unpadded base64url of
+      action byte, flag byte, then the fixed-width nonce, room id,
+      target id and separator-joined args that are present; a kill
+      button is 20 characters instead of 26;
+    - otherwise ``action:1:room_id:target_id[:arg...]``.
+    Packed buttons of a room carry its current nonce (room_nonces), so
+    the router can reject buttons from an earlier phase. decode() also
+    reads the underscore-joined strings buttons used before.
+    """
+    action: str
+    room_id: Optional[int] = None
+    target_id: Optional[int] = None
+    args: Tuple[str, ...] = ()
+    nonce: Optional[int] = field(default=None, compare=False)
+    version: int = field(default=TEXT_VERSION, compare=False)
+
+    def arg(self, index: int = 0, default: Optional[str] = None) -> Optional[str]:
+        return self.args[index] if index < len(self.args) else default
+
+    def encode(self) -> str:
+        if self.room_id is None and self.target_id is None and not self.args:
+            return self.action
+        if self.action in ACTION_CODES:
+            return self._encode_packed()
+        fields = [self.action, str(TEXT_VERSION),
+                  "" if self.room_id is None else str(self.room_id),
+                  "" if self.target_id is None else str(self.target_id)]
+        fields.extend(self.args)
+        while fields[-1] == "":
+            fields.pop()
+        return ":".join(fields)
+
+    def _encode_packed(self) -> str:
+        nonce = self.nonce
+        if nonce is None and self.room_id is not None:
+            nonce = room_nonces.get(self.room_id)
+        flags = 0
+        body = b""
+        if nonce is not None:
+            flags |= _HAS_NONCE
+            body += nonce.to_bytes(NONCE_BYTES, "big")
+        if self.room_id is not None:
+            flags |= _HAS_ROOM
+            body += self.room_id.to_bytes(ROOM_ID_BYTES, "big")
+        if self.target_id is not None:
+            flags |= _HAS_TARGET
+            body += self.target_id.to_bytes(TARGET_ID_BYTES, "big", signed=True)
+        if self.args:
+            flags |= _HAS_ARGS
+            body += ARG_SEPARATOR.join(self.args).encode("utf-8")
+        packed = bytes((ACTION_CODES[self.action], flags)) + body
+        return PACKED_MARKER + base64.urlsafe_b64encode(packed).rstrip(b"=").decode("ascii")
+
+    @classmethod
+    def decode(cls, data: str) -> "CallbackData":
+        if not data:
+            raise CallbackDataError("empty callback data")
+        if data.startswith(PACKED_MARKER):
+            return cls._decode_packed(data)
+        if ":" not in data:
+            return cls._decode_legacy(data)
+
+        action, version, *fields = data.split(":")
+        if version != str(TEXT_VERSION):
+            raise CallbackDataError(f"unsupported callback data version {version!r}")
+        fields += [""] * (2 - len(fields))
+        return cls(action,
+                   room_id=_parse_id(fields[0]),
+                   target_id=_parse_id(fields[1]),
+                   args=tuple(fields[2:]))
+
+    @classmethod
+    def _decode_packed(cls, data: str) -> "CallbackData":
+        encoded = data[len(PACKED_MARKER):]
+        try:
+            packed = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+        except ValueError:
+            raise CallbackDataError(f"malformed packed callback data {data!r}")
+        if len(packed) < 2 or packed[0] not in ACTIONS_BY_CODE:
+            raise CallbackDataError(f"unknown packed callback data {data!r}")
+
+        flags = packed[1]
+        offset = 2
+        values = {}
+        for flag, name, width, signed in ((_HAS_NONCE, "nonce", NONCE_BYTES, False),
+                                          (_HAS_ROOM, "room_id", ROOM_ID_BYTES, False),
+                                          (_HAS_TARGET, "target_id", TARGET_ID_BYTES, True)):
+            if flags & flag:
+                if offset + width > len(packed):
+                    raise CallbackDataError(f"truncated packed callback data {data!r}")
+                values[name] = int.from_bytes(packed[offset:offset + width], "big", signed=signed)
+                offset += width
+        args = ()
+        if flags & _HAS_ARGS:
+            try:
+                args = tuple(packed[offset:].decode("utf-8").split(ARG_SEPARATOR))
+            except UnicodeDecodeError:
+                raise CallbackDataError(f"malformed packed callback data {data!r}")
+        return cls(ACTIONS_BY_CODE[packed[0]], args=args, version=PACKED_VERSION, **values)
+
+    @classmethod
+    def _decode_legacy(cls, data: str) -> "CallbackData":
+        if data in LEGACY_ACTIONS:
+            return cls(LEGACY_ACTIONS[data])
+        # Longest matching prefix first, so "boss_kill_" wins over "kill_"
+        end = data.rfind("_")
+        while end > 0:
+            prefix = data[:end + 1]
+            if prefix in LEGACY_PREFIXES:
+                action, names = LEGACY_PREFIXES[prefix]
+                values = data[end + 1:].split("_", len(names) - 1)
+                if len(values) != len(names):
+                    raise CallbackDataError(f"malformed callback data {data!r}")
+                fields = {"room_id": None, "target_id": None}
+                args = []
+                for name, value in zip(names, values):
+                    if name == "arg":
+                        args.append(value)
+                    else:
+                        fields[name] = _parse_id(value)
+                return cls(action, args=tuple(args), **fields)
+            end = data.rfind("_", 0, end)
+        # A plain action ("main_menu") or a command name (see bot_commands)
+        return cls(data)
+
+
+def _parse_id(value: str) -> Optional[int]:
+    if value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise CallbackDataError(f"invalid id {value!r} in callback data")
+
+
+class RoomNonces:
+    """Current button nonce of each room.
+
+    room_manager sets a new one whenever a room changes phase and drops it
+    with the room. Checking a button against it is one dict lookup, so
+    stale buttons are turned away without loading (or waking) the room.
+    Rooms it does not know, e.g. hibernated since a restart, pass.
+    """
+
+    def __init__(self):
+        self._nonces: Dict[int, int] = {}
+
+    def get(self, room_id: int) -> Optional[int]:
+        return self._nonces.get(room_id)
+
+    def set(self, room_id: int, nonce: int):
+        self._nonces[room_id] = nonce
+
+    def forget(self, room_id: int):
+        self._nonces.pop(room_id, None)
+
+    def is_current(self, room_id: int, nonce: int) -> bool:
+        current = self._nonces.get(room_id)
+        return current is None or current == nonce
+
+
+room_nonces = RoomNonces()
+
+
+class CallbackRouter:
+    """One entry point for every button.
+
+    Handlers are registered per action code and looked up in a dict, so
+    dispatch costs the same however many buttons there are. A handler is
+    called as ``handler(update, context, data)`` with the decoded
+    CallbackData; actions without a handler go to the fallback. Buttons
+    whose nonce is not their room's current one are answered without
+    calling a handler.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, Callable] = {}
+        self._fallback: Optional[Callable] = None
+        self.stale = 0
+
+    def register(self, action: str, callback: Callable):
+        """Register the handler of ``action``"""
+        if action in self._handlers:
+            raise ValueError(f"Callback action {action!r} is already registered")
+        self._handlers[action] = callback
+
+    def register_fallback(self, callback: Callable):
+        """Handler for actions nobody registered"""
+        self._fallback = callback
+
+    @property
+    def actions(self):
+        return set(self._handlers)
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        if not query:
+            return
+        try:
+            data = CallbackData.decode(query.data)
+        except CallbackDataError as e:
+            print(f"Error decoding callback data: {e}")
+            await query.answer("❌ This button is no longer valid!", show_alert=True)
+            return
+        if data.nonce is not None and data.room_id is not None and not room_nonces.is_current(data.room_id, data.nonce):
+            self.stale += 1
+            await query.answer("⌛ This button is from an earlier phase of the game.", show_alert=True)
+            return
+
+        handler = self._handlers.get(data.action, self._fallback)
+        if handler is None:
+            return
+        try:
+            return await handler(update, context, data)
+        except Exception as e:
+            print(f"Error handling callback {data.action}: {e}")
+            await query.answer(f"Error: {str(e)}", show_alert=True)
+
+
+callback_router = CallbackRouter()
@@ -0,0 +1,313 @@
+"""
+Multi-Process Sharding
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import asyncio
+import collections
+import logging
+import multiprocessing
+import signal
+import threading
+import zlib
+from typing import Dict, List, Optional
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+from router import CallbackData, CallbackDataError
+
+# Seconds a worker gets to finish its updates and save before it is killed
+WORKER_STOP_TIMEOUT = 15
+
+
+def shard_for_chat(chat_id: int, shards: int) -> int:
+    """The worker that owns chat ``chat_id``; stable across restarts"""
+    return zlib.crc32(str(chat_id).encode()) % shards
+
+
+class PipeWriter:
+    """Sends messages over a multiprocessing Connection from its own thread.
+
+    Connection.send blocks once the pipe buffer (about 64 KB) is full,
+    e.g. while the other process is busy, and that must not stall the
+    sender's event loop. send() only queues, in order; past
+    ``high_water`` queued messages it warns that the reader is behind.
+    """
+
+    _CLOSE = object()
+
+    def __init__(self, conn, name: str, high_water: int = 10000):
+        self.conn = conn
+        self.high_water = high_water
+        self._messages = collections.deque()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._behind = False
+        self.broken = False
+
+    @property
+    def depth(self) -> int:
+        return len(self._messages)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._messages:
+                    self._cond.wait()
+                message = self._messages.popleft()
+            if message is self._CLOSE:
+                return
+            try:
+                self.conn.send(message)
+            except (BrokenPipeError, OSError) as e:
+                logging.error(f"Error sending on {self._thread.name}: {e}")
+                with self._cond:
+                    self.broken = True
+                    self._messages.clear()
+                return
+
+    def send(self, message) -> bool:
+        """Queue ``message``; False once the pipe has broken"""
+        with self._cond:
+            if self.broken:
+                return False
+            self._messages.append(message)
+            self._cond.notify()
+            if len(self._messages) >= self.high_water:
+                if not self._behind:
+                    self._behind = True
+                    logging.warning(f"{self._thread.name} is {len(self._messages)} messages behind")
+            else:
+                self._behind = False
+        return True
+
+    def close(self, timeout: Optional[float] = None):
+        """Send what is queued, then stop the thread"""
+        with self._cond:
+            self._messages.append(self._CLOSE)
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+
+class ShardMap:
+    """Decides which worker an update goes to.
+
+    Group chats are split by a hash of the chat id, so a room lives in the
+    worker of its group. Private chats (role PMs and their buttons) go to
+    the worker of a room the user plays in, which the workers report
+    through player(); users in no room fall back to the hash of their id.
+    """
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        # room_id -> (shard, number of players)
+        self._rooms: Dict[int, List[int]] = {}
+        # player_id -> room ids, oldest first
+        self._player_rooms: Dict[int, Dict[int, None]] = {}
+
+    def player(self, shard: int, player_id: int, room_id: int, present: bool):
+        """A worker's room gained (``present``) or lost a player"""
+        if present:
+            room = self._rooms.setdefault(room_id, [shard, 0])
+            room[0] = shard
+            room[1] += 1
+            self._player_rooms.setdefault(player_id, {})[room_id] = None
+            return
+        room = self._rooms.get(room_id)
+        if room is not None:
+            room[1] -= 1
+            if room[1] <= 0:
+                del self._rooms[room_id]
+        room_ids = self._player_rooms.get(player_id)
+        if room_ids is not None:
+            room_ids.pop(room_id, None)
+            if not room_ids:
+                del self._player_rooms[player_id]
+
+    def room_shard(self, room_id: int) -> Optional[int]:
+        room = self._rooms.get(room_id)
+        return room[0] if room else None
+
+    def shard_for(self, update: Update) -> int:
+        query = update.callback_query
+        if query is not None and query.data:
+            try:
+                room_id = CallbackData.decode(query.data).room_id
+            except CallbackDataError:
+                room_id = None
+            if room_id is not None and room_id in self._rooms:
+                return self._rooms[room_id][0]
+
+        chat = update.effective_chat
+        if chat is not None and chat.type != "private":
+            return shard_for_chat(chat.id, self.shards)
+
+        user = update.effective_user
+        if user is not None:
+            room_ids = self._player_rooms.get(user.id)
+            if room_ids:
+                return self._rooms[next(reversed(room_ids))][0]
+            return shard_for_chat(user.id, self.shards)
+        if chat is not None:
+            return shard_for_chat(chat.id, self.shards)
+        return update.update_id % self.shards
+
+
+class ShardedFront:
+    """The front process: receives updates and hands them to N workers.
+
+    Each worker is a process running the full bot (main.build_application)
+    on its own rooms and temporary game data. Updates go to it over a
+    multiprocessing Pipe as Update.to_dict(), written by a PipeWriter per
+    worker; it reports player/room changes back over the same Pipe to
+    keep the ShardMap current.
+    Install with build_front(); post_init starts the workers and
+    post_shutdown stops them.
+    """
+
+    def __init__(self, shards: int, worker=None):
+        self.shards = shards
+        self.map = ShardMap(shards)
+        self._worker = worker or run_worker
+        self._processes: List[multiprocessing.Process] = []
+        self._conns = []
+        self._writers: List[PipeWriter] = []
+        self.forwarded = [0] * shards
+
+    async def start(self, application=None):
+        context = multiprocessing.get_context("spawn")
+        loop = asyncio.get_running_loop()
+        for shard in range(self.shards):
+            front_end, worker_end = context.Pipe()
+            process = context.Process(target=self._worker, args=(shard, self.shards, worker_end),
+                                      name=f"shard-{shard}", daemon=False)
+            process.start()
+            worker_end.close()
+            self._processes.append(process)
+            self._conns.append(front_end)
+            writer = PipeWriter(front_end, f"shard-{shard}-writer")
+            writer.start()
+            self._writers.append(writer)
+            loop.add_reader(front_end.fileno(), self._read, shard)
+        logging.info(f"Started {self.shards} shard workers")
+
+    def _read(self, shard: int):
+        conn = self._conns[shard]
+        try:
+            while conn.poll():
+                kind, *message = conn.recv()
+                if kind == "player":
+                    self.map.player(shard, *message)
+        except (EOFError, OSError):
+            asyncio.get_running_loop().remove_reader(conn.fileno())
+            logging.error(f"Shard {shard} worker went away")
+
+    async def forward(self, update: Update, context):
+        shard = self.map.shard_for(update)
+        if self._writers[shard].send(update.to_dict()):
+            self.forwarded[shard] += 1
+        else:
+            logging.error(f"Error forwarding update to shard {shard}: its pipe is closed")
+
+    async def stop(self, application=None):
+        loop = asyncio.get_running_loop()
+        for conn, writer in zip(self._conns, self._writers):
+            try:
+                loop.remove_reader(conn.fileno())
+            except OSError:
+                pass
+            # Queued after the updates still waiting to go out
+            writer.send(None)
+        for writer in self._writers:
+            await loop.run_in_executor(None, writer.close, WORKER_STOP_TIMEOUT)
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                logging.warning(f"{process.name} did not stop in time, terminating it")
+                process.terminate()
+        for conn in self._conns:
+            conn.close()
+        self._processes.clear()
+        self._conns.clear()
+        self._writers.clear()
+
+
+def build_front(shards: int) -> Application:
+    """Application for the front process: every update goes to a worker"""
+    from config import BOT_TOKEN
+
+    front = ShardedFront(shards)
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(front.start)
+        .post_shutdown(front.stop)
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, front.forward))
+    return application
+
+
+class PipeUpdates:
+    """Update source of a worker: what the front sends over its Pipe"""
+
+    def __init__(self, conn, application, done: asyncio.Event):
+        self.conn = conn
+        self.application = application
+        self.done = done
+
+    async def start(self):
+        asyncio.get_running_loop().add_reader(self.conn.fileno(), self._read)
+
+    def _read(self):
+        try:
+            while self.conn.poll():
+                data = self.conn.recv()
+                if data is None:
+                    self.done.set()
+                    return
+                update = Update.de_json(data, self.application.bot)
+                self.application.update_queue.put_nowait(update)
+        except (EOFError, OSError):
+            # The front process is gone
+            asyncio.get_running_loop().remove_reader(self.conn.fileno())
+            self.done.set()
+
+    async def stop(self):
+        asyncio.get_running_loop().remove_reader(self.conn.fileno())
+
+
+def run_worker(shard: int, shards: int, conn):
+    """Entry point of a worker process owning shard ``shard`` of ``shards``"""
+    # Ctrl+C reaches the whole process group; the front stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    import database
+    database.use_shard(shard)
+    import main as bot
+    from game_state import game_data
+    from outbox import Outbox
+    from room_manager import active_rooms
+    from webhook import run_application
+
+    # The Bot API limit is per token, so the workers split it
+    bot.outbox = Outbox(overall_per_second=30 / shards)
+    application = bot.build_application()
+    database.load_database(game_data)
+    # Sent from a thread, so a front busy reading other workers can't block this loop
+    writer = PipeWriter(conn, f"shard-{shard}-writer")
+    writer.start()
+    active_rooms.observer = lambda player_id, room_id, present: writer.send(("player", player_id, room_id, present))
+
+    async def serve():
+        done = asyncio.Event()
+        await run_application(application, done, [PipeUpdates(conn, application, done)])
+
+    logging.info(f"Shard {shard}/{shards} worker started")
+    asyncio.run(serve())
+    writer.close(WORKER_STOP_TIMEOUT)
+    conn.close()
@@ -1,6 +1,6 @@
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from game_state import game_data
+from router import CallbackData
 
 SHOP_ITEMS = {
     "protection": {
@@ -48,19 +48,8 @@ def get_shop_keyboard():
         keyboard.append([
             InlineKeyboardButton(
                 f"{item['icon']} {item['name']} - 💰{item['price']}", 
-                callback_data=f"buy_{item_id}"
+                callback_data=CallbackData("buy", args=(item_id,)).encode()
             )
         ])
     keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="main_menu")])
     return InlineKeyboardMarkup(keyboard)
-
-def get_player_stats(player_id):
-    if str(player_id) not in game_data["player_stats"]:
-        game_data["player_stats"][str(player_id)] = {
-            "money": 0,
-            "gems": 0,
-            "protection": 0,
-            "fake_id": 0,
-            "items": {}
-        }
-    return game_data["player_stats"][str(player_id)]
@@ -0,0 +1,183 @@
+"""
+Snapshot Format
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+
+Layout: b"MGS" + schema version (1 byte) + format (b"M" msgpack, b"J" JSON)
++ body. Files without the header are the old pretty JSON (version 0).
+"""
+
+import json
+import logging
+import os
+import struct
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MAGIC = b"MGS"
+SCHEMA_VERSION = 1
+FORMAT_MSGPACK = b"M"
+FORMAT_JSON = b"J"
+
+# msgpack extension type codes
+EXT_SET = 1
+EXT_OBJECT = 2
+
+# Keys of game_data that hold sets in memory
+SET_KEYS = ("waiting_for_roles", "protected_players", "used_actions")
+
+# tag -> (cls, to_state, from_state), see register_type()
+_types_by_tag: Dict[str, Tuple[type, Callable, Callable]] = {}
+_tags_by_type: Dict[type, str] = {}
+
+
+def register_type(tag: str, cls: type, to_state: Callable[[Any], Any], from_state: Callable[[Any], Any]):
+    """Let snapshots carry instances of ``cls`` (e.g. Room) natively"""
+    _types_by_tag[tag] = (cls, to_state, from_state)
+    _tags_by_type[cls] = tag
+
+
+class JSONCodec:
+    """Readable fallback; sets, int keys and objects are wrapped in marker dicts.
+
+    Keys written through pack_key (top-level keys and room/player entries
+    of partial flushes) become strings, as JSON object keys must be.
+    """
+
+    format = FORMAT_JSON
+
+    def _wrap(self, value):
+        if isinstance(value, dict):
+            if all(isinstance(k, str) for k in value):
+                return {k: self._wrap(v) for k, v in value.items()}
+            return {"__map__": [[k, self._wrap(v)] for k, v in value.items()]}
+        if isinstance(value, (list, tuple)):
+            return [self._wrap(v) for v in value]
+        if isinstance(value, (set, frozenset)):
+            return {"__set__": [self._wrap(v) for v in value]}
+        tag = _tags_by_type.get(type(value))
+        if tag is not None:
+            return {"__obj__": tag, "state": self._wrap(_types_by_tag[tag][1](value))}
+        return value
+
+    def _unwrap(self, value):
+        if isinstance(value, dict):
+            if "__set__" in value and len(value) == 1:
+                return set(self._unwrap(v) for v in value["__set__"])
+            if "__map__" in value and len(value) == 1:
+                return {k: self._unwrap(v) for k, v in value["__map__"]}
+            if "__obj__" in value and len(value) == 2:
+                return _types_by_tag[value["__obj__"]][2](self._unwrap(value["state"]))
+            return {k: self._unwrap(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._unwrap(v) for v in value]
+        return value
+
+    def pack(self, value) -> bytes:
+        return json.dumps(self._wrap(value), separators=(",", ":")).encode("utf-8")
+
+    def pack_key(self, key) -> bytes:
+        return json.dumps(str(key)).encode("utf-8")
+
+    def assemble_map(self, items: Iterable[Tuple[bytes, bytes]]) -> bytes:
+        return b"{" + b",".join(k + b":" + v for k, v in items) + b"}"
+
+    def unpack(self, body: bytes):
+        return self._unwrap(json.loads(body))
+
+
+class MsgpackCodec:
+    """Compact binary format with native int keys, sets and registered objects"""
+
+    format = FORMAT_MSGPACK
+
+    def _default(self, value):
+        if isinstance(value, (set, frozenset)):
+            return msgpack.ExtType(EXT_SET, self.pack(list(value)))
+        tag = _tags_by_type.get(type(value))
+        if tag is not None:
+            return msgpack.ExtType(EXT_OBJECT, self.pack([tag, _types_by_tag[tag][1](value)]))
+        raise TypeError(f"Cannot snapshot object of type {type(value).__name__}")
+
+    def _ext_hook(self, code, data):
+        if code == EXT_SET:
+            return set(self.unpack(data))
+        if code == EXT_OBJECT:
+            tag, state = self.unpack(data)
+            return _types_by_tag[tag][2](state)
+        return msgpack.ExtType(code, data)
+
+    def pack(self, value) -> bytes:
+        return msgpack.packb(value, default=self._default, use_bin_type=True)
+
+    def pack_key(self, key) -> bytes:
+        return msgpack.packb(key, use_bin_type=True)
+
+    def assemble_map(self, items: Iterable[Tuple[bytes, bytes]]) -> bytes:
+        # msgpack is a stream format: a map32 header followed by its pairs
+        items = list(items)
+        return b"\xdf" + struct.pack(">I", len(items)) + b"".join(k + v for k, v in items)
+
+    def unpack(self, body: bytes):
+        return msgpack.unpackb(body, ext_hook=self._ext_hook, raw=False, strict_map_key=False)
+
+
+def get_codec(name: str = None):
+    """Pick the snapshot codec; MAFIA_SNAPSHOT_FORMAT=json forces the readable one"""
+    name = name or os.getenv("MAFIA_SNAPSHOT_FORMAT", "msgpack")
+    if name == "msgpack" and msgpack is not None:
+        return MsgpackCodec()
+    return JSONCodec()
+
+
+_CODECS = {FORMAT_JSON: JSONCodec}
+if msgpack is not None:
+    _CODECS[FORMAT_MSGPACK] = MsgpackCodec
+
+
+def header(codec) -> bytes:
+    return MAGIC + bytes([SCHEMA_VERSION]) + codec.format
+
+
+def encode(data: Dict, codec=None) -> bytes:
+    codec = codec or get_codec()
+    return header(codec) + codec.pack(data)
+
+
+def _upgrade_v0(data: Dict) -> Dict:
+    # Legacy JSON stored sets as plain lists
+    for key in SET_KEYS:
+        if isinstance(data.get(key), list):
+            data[key] = set(data[key])
+    return data
+
+
+# version -> function upgrading a snapshot from that version to the next one
+UPGRADES = {
+    0: _upgrade_v0,
+}
+
+
+def decode(blob: bytes) -> Dict:
+    if blob.startswith(MAGIC):
+        version = blob[len(MAGIC)]
+        fmt = blob[len(MAGIC) + 1:len(MAGIC) + 2]
+        codec_cls = _CODECS.get(fmt)
+        if codec_cls is None:
+            raise ValueError(f"Snapshot format {fmt!r} is not available (is msgpack installed?)")
+        data = codec_cls().unpack(blob[len(MAGIC) + 2:])
+    else:
+        version = 0
+        data = json.loads(blob)
+
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"Snapshot version {version} is newer than supported {SCHEMA_VERSION}")
+    while version < SCHEMA_VERSION:
+        data = UPGRADES[version](data)
+        version += 1
+        logging.info(f"Upgraded snapshot to version {version}")
+    return data
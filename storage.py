@@ -0,0 +1,328 @@
+"""
+User Storage Backends
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import logging
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+
+class UserStore:
+    """Base class for per-user stat storage keyed by user id"""
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def put(self, user_id: int, stats: Dict):
+        raise NotImplementedError
+
+    def put_many(self, rows: Dict[int, Dict]):
+        for user_id, stats in rows.items():
+            self.put(user_id, stats)
+
+    def update_many(self, updates: Dict[int, Any], apply: Callable[[Optional[Dict], Any], Dict]):
+        """Replace each user's row with ``apply(row, update)``; row is None for a new user"""
+        for user_id, update in updates.items():
+            self.put(user_id, apply(self.get(user_id), update))
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def iter_users(self) -> Iterator[Tuple[int, Dict]]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JSONUserStore(UserStore):
+    """Legacy backend: the whole user_database.json is read and rewritten per call"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _load(self) -> Dict:
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    return json.load(f)
+        except Exception as e:
+            logging.error(f"Error loading user database: {e}")
+        return {"users": {}}
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        return self._load()["users"].get(str(user_id))
+
+    def put(self, user_id: int, stats: Dict):
+        data = self._load()
+        data["users"][str(user_id)] = stats
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(data, f, indent=2)
+        except Exception as e:
+            logging.error(f"Error saving user database: {e}")
+
+    def count(self) -> int:
+        return len(self._load()["users"])
+
+    def iter_users(self) -> Iterator[Tuple[int, Dict]]:
+        for user_id, stats in self._load()["users"].items():
+            yield int(user_id), stats
+
+
+class SQLiteUserStore(UserStore):
+    """Embedded SQLite backend (WAL mode), one row per user"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id INTEGER PRIMARY KEY, "
+            "data TEXT NOT NULL)"
+        )
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM users WHERE user_id = ?", (int(user_id),)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, user_id: int, stats: Dict):
+        payload = json.dumps(stats, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO users (user_id, data) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                (int(user_id), payload)
+            )
+
+    def put_many(self, rows: Dict[int, Dict]):
+        """Write several users in a single transaction"""
+        payload = [(int(uid), json.dumps(stats, separators=(",", ":"))) for uid, stats in rows.items()]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO users (user_id, data) VALUES (?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                    payload
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def update_many(self, updates: Dict[int, Any], apply: Callable[[Optional[Dict], Any], Dict]):
+        """Update several users in one BEGIN IMMEDIATE transaction.
+
+        Another process writing the same rows waits for it, so neither
+        read-modify-write overwrites the other's changes.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, update in updates.items():
+                    row = self._conn.execute(
+                        "SELECT data FROM users WHERE user_id = ?", (int(user_id),)
+                    ).fetchone()
+                    stats = apply(json.loads(row[0]) if row else None, update)
+                    self._conn.execute(
+                        "INSERT INTO users (user_id, data) VALUES (?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                        (int(user_id), json.dumps(stats, separators=(",", ":")))
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def iter_users(self) -> Iterator[Tuple[int, Dict]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, data FROM users").fetchall()
+        for user_id, data in rows:
+            yield user_id, json.loads(data)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SQLiteCounterStore:
+    """Named integer counters in a SQLite file.
+
+    Updates run in BEGIN IMMEDIATE transactions, so processes sharing the
+    file never read the same value.
+    """
+
+    def __init__(self, path: str, timeout: float = 10.0):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            "name TEXT PRIMARY KEY, "
+            "value INTEGER NOT NULL)"
+        )
+
+    def lease(self, name: str, count: int) -> int:
+        """Reserve ``count`` consecutive values of counter ``name``; returns the first"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+                start = row[0] if row else 0
+                self._conn.execute(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                    (name, start + count)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return start
+
+    def setdefault(self, name: str, value: int) -> int:
+        """Value of counter ``name``, created as ``value`` if it does not exist"""
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, ?)", (name, value))
+            return self._conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class QueuedUserStore(UserStore):
+    """Hands writes to a background submitter and serves reads from them until done.
+
+    ``submit(fn, *args)`` must run jobs in order and return a
+    concurrent.futures.Future (see persistence.PersistenceWorker).
+    """
+
+    def __init__(self, inner: UserStore, submit):
+        self.inner = inner
+        self._submit = submit
+        self._pending: Dict[int, Dict] = {}
+        # user_id -> [apply, update] pairs queued by update_many, oldest first
+        self._updates: Dict[int, list] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        user_id = int(user_id)
+        with self._lock:
+            pending = self._pending.get(user_id)
+            updates = list(self._updates.get(user_id, ()))
+        if pending is not None:
+            row = json.loads(json.dumps(pending))
+        else:
+            row = self.inner.get(user_id)
+        for apply, update in updates:
+            row = apply(row, update)
+        return row
+
+    def _settle(self, rows: Dict[int, Dict]):
+        def done(_future):
+            with self._lock:
+                for uid, stats in rows.items():
+                    if self._pending.get(uid) is stats:
+                        del self._pending[uid]
+        return done
+
+    def _settle_updates(self, queued: Dict[int, list]):
+        def done(_future):
+            with self._lock:
+                for uid, entry in queued.items():
+                    entries = self._updates.get(uid)
+                    if entries is not None and entry in entries:
+                        entries.remove(entry)
+                        if not entries:
+                            del self._updates[uid]
+        return done
+
+    def put(self, user_id: int, stats: Dict):
+        self.put_many({user_id: stats})
+
+    def put_many(self, rows: Dict[int, Dict]):
+        # Copy so later caller mutations don't leak into the queued write
+        rows = {int(uid): json.loads(json.dumps(stats)) for uid, stats in rows.items()}
+        with self._lock:
+            self._pending.update(rows)
+            # The queued updates run first and this row replaces their result
+            for uid in rows:
+                self._updates.pop(uid, None)
+        future = self._submit(self.inner.put_many, rows)
+        future.add_done_callback(self._settle(rows))
+        return future
+
+    def update_many(self, updates: Dict[int, Any], apply: Callable[[Optional[Dict], Any], Dict]):
+        updates = {int(uid): json.loads(json.dumps(update)) for uid, update in updates.items()}
+        queued = {uid: [apply, update] for uid, update in updates.items()}
+        with self._lock:
+            for uid, entry in queued.items():
+                self._updates.setdefault(uid, []).append(entry)
+        future = self._submit(self.inner.update_many, updates, apply)
+        future.add_done_callback(self._settle_updates(queued))
+        return future
+
+    def count(self) -> int:
+        return self.inner.count()
+
+    def iter_users(self) -> Iterator[Tuple[int, Dict]]:
+        with self._lock:
+            pending = dict(self._pending)
+            updates = {uid: list(entries) for uid, entries in self._updates.items()}
+        for user_id, stats in self.inner.iter_users():
+            stats = pending.pop(user_id, stats)
+            for apply, update in updates.pop(user_id, ()):
+                stats = apply(stats, update)
+            yield user_id, stats
+        for user_id, stats in pending.items():
+            for apply, update in updates.pop(user_id, ()):
+                stats = apply(stats, update)
+            yield user_id, stats
+        for user_id, entries in updates.items():
+            stats = None
+            for apply, update in entries:
+                stats = apply(stats, update)
+            yield user_id, stats
+
+    def close(self):
+        self.inner.close()
+
+
+def migrate_json_users(json_path: str, store: SQLiteUserStore) -> int:
+    """One-shot import of user_database.json into the SQLite store.
+
+    The JSON file is renamed to ``<name>.migrated`` afterwards so the
+    import never runs twice. Returns the number of users imported.
+    """
+    if not os.path.exists(json_path):
+        return 0
+
+    try:
+        with open(json_path, 'r') as f:
+            users = json.load(f).get("users", {})
+    except Exception as e:
+        logging.error(f"Error reading {json_path} for migration: {e}")
+        return 0
+
+    store.put_many({int(uid): stats for uid, stats in users.items()})
+    os.replace(json_path, json_path + ".migrated")
+    logging.info(f"Migrated {len(users)} users from {json_path}")
+    return len(users)
@@ -0,0 +1,83 @@
+import asyncio
+import time
+import unittest
+
+from outbox import Outbox, TokenBucket, _Gate, _Request
+
+
+class GateCancellationTest(unittest.IsolatedAsyncioTestCase):
+    async def test_cancelled_waiter_does_not_hold_the_gate(self):
+        gate = _Gate(TokenBucket(100, 100), exclusive=True)
+        self.assertTrue(await gate.acquire(_Request(1, 0)))
+
+        waiter = asyncio.create_task(gate.acquire(_Request(1, 1)))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+
+        gate.release()
+        self.assertTrue(await asyncio.wait_for(gate.acquire(_Request(1, 2)), 1))
+
+
+class OutboxCancellationTest(unittest.IsolatedAsyncioTestCase):
+    async def send(self, outbox, chat_id, text):
+        async def callback(**kwargs):
+            return kwargs["text"]
+        data = {"chat_id": chat_id, "text": text}
+        return await outbox.process_request(callback, (), data, "sendMessage", data, None)
+
+    async def test_cancel_while_waiting_for_global_token_releases_chat(self):
+        outbox = Outbox(private_per_second=100)
+        # The chat gate is granted at once, the global one makes the send wait
+        outbox.overall.bucket.pause(time.monotonic() + 0.2)
+        send = asyncio.create_task(self.send(outbox, 5, "first"))
+        await asyncio.sleep(0.05)
+        self.assertTrue(outbox._chats[5].gate.busy)
+
+        send.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await send
+        self.assertFalse(outbox._chats[5].gate.busy)
+        self.assertEqual(await asyncio.wait_for(self.send(outbox, 5, "second"), 2), "second")
+
+
+class EditCollapseCancellationTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.sent = []
+
+    async def edit(self, outbox, text):
+        async def callback(**kwargs):
+            self.sent.append(kwargs["text"])
+            return kwargs["text"]
+        data = {"chat_id": 5, "message_id": 1, "text": text}
+        return await outbox.process_request(callback, (), data, "editMessageText", data, None)
+
+    async def queue_edits(self, outbox, *texts):
+        outbox.overall.bucket.pause(time.monotonic() + 0.2)
+        edits = []
+        for text in texts:
+            edits.append(asyncio.create_task(self.edit(outbox, text)))
+            await asyncio.sleep(0.01)
+        return edits
+
+    async def test_cancelled_newer_edit_lets_the_older_one_send(self):
+        outbox = Outbox(private_per_second=100)
+        first, second = await self.queue_edits(outbox, "A", "B")
+        second.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await second
+        self.assertEqual(await asyncio.wait_for(first, 2), "A")
+        self.assertEqual(self.sent, ["A"])
+
+    async def test_older_edit_follows_a_still_newer_one(self):
+        outbox = Outbox(private_per_second=100)
+        first, second, third = await self.queue_edits(outbox, "A", "B", "C")
+        second.cancel()
+        self.assertEqual(await asyncio.wait_for(first, 2), "C")
+        self.assertEqual(await asyncio.wait_for(third, 2), "C")
+        self.assertEqual(self.sent, ["C"])
+
+
+if __name__ == "__main__":
+    unittest.main()
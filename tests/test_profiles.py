@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from profiles import ProfileCache, apply_changes, profile_changes
+from storage import SQLiteUserStore
+
+
+class AdditiveProfileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.dir.name, "users.sqlite3")
+        # Two connections to one file, as two shard workers have
+        self.stores = [SQLiteUserStore(path), SQLiteUserStore(path)]
+        self.caches = [ProfileCache(lambda store=store: store, additive=True) for store in self.stores]
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        self.dir.cleanup()
+
+    def test_writes_from_two_caches_add_up(self):
+        first, second = (cache.get(1) for cache in self.caches)
+        first.points += 100
+        first.wins += 1
+        first.achievements.append("first_win")
+        second.points += 50
+        second.games_played += 1
+        second.items["shield"] = 2
+        self.caches[0].save(1)
+        self.caches[1].save(1)
+
+        stored = self.stores[0].get(1)
+        self.assertEqual(stored["points"], 150)
+        self.assertEqual(stored["wins"], 1)
+        self.assertEqual(stored["games_played"], 1)
+        self.assertEqual(stored["achievements"], ["first_win"])
+        self.assertEqual(stored["items"], {"shield": 2})
+        self.assertEqual(stored["balance"], 1000)
+
+    def test_second_write_sends_only_new_changes(self):
+        profile = self.caches[0].get(1)
+        profile.points += 10
+        self.caches[0].save(1)
+        self.caches[1].get(1).points += 5
+        self.caches[1].save(1)
+        profile.points += 1
+        self.caches[0].save(1)
+        self.assertEqual(self.stores[0].get(1)["points"], 16)
+
+
+class ProfileChangesTest(unittest.TestCase):
+    def test_round_trip(self):
+        old = {"points": 5, "items": {"a": 1, "b": 1}, "achievements": ["x"], "username": "old"}
+        new = {"points": 8, "items": {"a": 3}, "achievements": ["x", "y"], "username": "new"}
+        row = apply_changes({"points": 100, "items": {"b": 2}, "achievements": ["z"]}, profile_changes(old, new))
+        self.assertEqual(row["points"], 103)
+        self.assertEqual(row["items"], {"a": 2, "b": 1})
+        self.assertEqual(row["achievements"], ["z", "y"])
+        self.assertEqual(row["username"], "new")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import multiprocessing
+import time
+import unittest
+
+from sharding import PipeWriter
+
+
+class PipeWriterTest(unittest.TestCase):
+    def test_send_does_not_block_on_a_full_pipe(self):
+        ours, theirs = multiprocessing.Pipe()
+        writer = PipeWriter(ours, "test-writer")
+        writer.start()
+        # Far more than the pipe buffer holds while nobody reads
+        started = time.perf_counter()
+        for i in range(200):
+            self.assertTrue(writer.send((i, "x" * 10000)))
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+        received = [theirs.recv()[0] for _ in range(200)]
+        self.assertEqual(received, list(range(200)))
+        writer.close(5)
+        ours.close()
+        theirs.close()
+
+    def test_send_fails_once_the_other_end_is_gone(self):
+        ours, theirs = multiprocessing.Pipe()
+        theirs.close()
+        writer = PipeWriter(ours, "test-writer")
+        writer.start()
+        writer.send("lost")
+        writer.close(5)
+        self.assertTrue(writer.broken)
+        self.assertFalse(writer.send("lost"))
+        ours.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
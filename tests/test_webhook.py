@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import SECRET_HEADER, WebhookServer, run_application
+
+
+class FakeApplication:
+    """Records the lifecycle calls run_application makes"""
+
+    def __init__(self):
+        self.calls = []
+        self.running = False
+
+    async def initialize(self):
+        self.calls.append("initialize")
+
+    async def start(self):
+        self.running = True
+        self.calls.append("start")
+
+    async def stop(self):
+        self.running = False
+        self.calls.append("stop")
+
+    async def shutdown(self):
+        self.calls.append("shutdown")
+
+    async def post_init(self, application):
+        self.calls.append("post_init")
+
+    async def post_stop(self, application):
+        self.calls.append("post_stop")
+
+    async def post_shutdown(self, application):
+        self.calls.append("post_shutdown")
+
+
+class RunApplicationTest(unittest.IsolatedAsyncioTestCase):
+    async def test_post_stop_runs_before_shutdown(self):
+        application = FakeApplication()
+        stop = asyncio.Event()
+        stop.set()
+        await run_application(application, stop)
+        self.assertEqual(application.calls, [
+            "initialize", "post_init", "start",
+            "stop", "post_stop", "shutdown", "post_shutdown",
+        ])
+
+
+class WebhookBackPressureTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.application = SimpleNamespace(update_queue=asyncio.Queue(), bot=None)
+        self.server = WebhookServer(self.application, "secret", max_pending=2)
+        self.client = TestClient(TestServer(self.server.make_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def post(self, update_id):
+        return await self.client.post("/telegram", json={"update_id": update_id},
+                                      headers={SECRET_HEADER: "secret"})
+
+    async def test_updates_being_handled_count_as_pending(self):
+        for update_id in (1, 2):
+            self.assertEqual((await self.post(update_id)).status, 200)
+        # What a concurrent_updates Application does: take them off the queue at once
+        for _ in range(2):
+            self.application.update_queue.get_nowait()
+        self.assertEqual(self.application.update_queue.qsize(), 0)
+
+        response = await self.post(3)
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual((await self.client.get("/healthz")).status, 503)
+
+        # Handlers finished
+        self.application.update_queue.task_done()
+        self.assertEqual((await self.post(3)).status, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+"""
+Shared Timer Wheel
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import asyncio
+import logging
+import math
+from typing import Callable, Iterable, List, Optional
+
+
+class TimerHandle:
+    __slots__ = ("when", "tick", "callback", "args", "cancelled", "_wheel")
+
+    def __init__(self, wheel, when, callback, args):
+        self._wheel = wheel
+        self.when = when
+        self.tick = 0
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self._wheel._count -= 1
+
+
+class TimerWheel:
+    """Hierarchical timing wheel driven by one asyncio task.
+
+    Level 0 has ``slots`` buckets of ``resolution`` seconds, and each
+    higher level covers ``slots`` times the span of the one below. Timers
+    cascade down a level as their bucket comes up, so scheduling and
+    cancelling are O(1) and the ticker wakes once per ``resolution``
+    however many timers are pending (and not at all when there are none).
+    """
+
+    def __init__(self, resolution: float = 1.0, slots: int = 64, levels: int = 3):
+        self.resolution = resolution
+        self.slots = slots
+        self._levels: List[List[list]] = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._tick = 0
+        self._start = 0.0
+        self._count = 0
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks = set()
+
+    def __len__(self):
+        return self._count
+
+    def time(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def schedule(self, delay: float, callback: Callable, *args) -> TimerHandle:
+        """Call ``callback(*args)`` after ``delay`` seconds (coroutines run as tasks)"""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        if self._count == 0:
+            # Idle wheel: restart the tick count instead of replaying idle ticks
+            self._start = loop.time()
+            self._tick = 0
+            self._wakeup.set()
+
+        handle = TimerHandle(self, loop.time() + max(0.0, delay), callback, args)
+        self._count += 1
+        self._insert(handle)
+        return handle
+
+    def _insert(self, handle: TimerHandle):
+        handle.tick = max(math.ceil((handle.when - self._start) / self.resolution), self._tick + 1)
+        delta = handle.tick - self._tick
+        span = 1
+        for level, buckets in enumerate(self._levels):
+            if delta < span * self.slots or level == len(self._levels) - 1:
+                buckets[(handle.tick // span) % self.slots].append(handle)
+                return
+            span *= self.slots
+
+    def _advance(self):
+        self._tick += 1
+        span = self.slots
+        for buckets in self._levels[1:]:
+            if self._tick % span:
+                break
+            index = (self._tick // span) % self.slots
+            bucket, buckets[index] = buckets[index], []
+            for handle in bucket:
+                if not handle.cancelled:
+                    self._insert(handle)
+            span *= self.slots
+
+        index = self._tick % self.slots
+        due, self._levels[0][index] = self._levels[0][index], []
+        for handle in due:
+            if handle.cancelled:
+                continue
+            if handle.tick > self._tick:
+                # Parked in the top level beyond its range; place it again
+                self._insert(handle)
+                continue
+            handle.cancelled = True
+            self._count -= 1
+            self._fire(handle)
+
+    def _fire(self, handle: TimerHandle):
+        try:
+            result = handle.callback(*handle.args)
+            if asyncio.iscoroutine(result):
+                task = asyncio.get_running_loop().create_task(result)
+                self._tasks.add(task)
+                task.add_done_callback(self._task_done)
+        except Exception as e:
+            logging.error(f"Error in timer callback: {e}")
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Error in timer callback: {task.exception()}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._count == 0:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            next_tick = self._start + (self._tick + 1) * self.resolution
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            now_tick = int((loop.time() - self._start) / self.resolution)
+            while self._tick < now_tick and self._count:
+                self._advance()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._tasks):
+            task.cancel()
+
+
+class Countdown:
+    """A deadline plus reminder points (seconds before the deadline).
+
+    Each reminder fires at most once, even across extend(). Callbacks may
+    be coroutine functions. ``on_reminder`` receives the reminder's seconds.
+    """
+
+    def __init__(self, wheel: TimerWheel, duration: float, on_deadline: Callable,
+                 on_reminder: Optional[Callable] = None, reminders: Iterable[int] = ()):
+        self.wheel = wheel
+        self.deadline = wheel.time() + duration
+        self.reminders = sorted(set(reminders), reverse=True)
+        self._on_deadline = on_deadline
+        self._on_reminder = on_reminder
+        self._fired = set()
+        self._handles: List[TimerHandle] = []
+        self.done = False
+        self._arm()
+
+    @property
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - self.wheel.time())
+
+    def _arm(self):
+        for handle in self._handles:
+            handle.cancel()
+        remaining = self.remaining
+        self._handles = [self.wheel.schedule(remaining, self._expire)]
+        if self._on_reminder is not None:
+            for seconds in self.reminders:
+                if seconds not in self._fired and seconds < remaining:
+                    self._handles.append(self.wheel.schedule(remaining - seconds, self._remind, seconds))
+
+    def _remind(self, seconds):
+        if self.done or seconds in self._fired:
+            return None
+        self._fired.add(seconds)
+        return self._on_reminder(seconds)
+
+    def _expire(self):
+        if self.done:
+            return None
+        self.cancel()
+        return self._on_deadline()
+
+    def extend(self, seconds: float) -> bool:
+        """Push the deadline back; reminders already sent are not repeated"""
+        if self.done:
+            return False
+        self.deadline += seconds
+        self._arm()
+        return True
+
+    def cancel(self):
+        self.done = True
+        for handle in self._handles:
+            handle.cancel()
+        self._handles = []
+
+
+# Process-wide wheel shared by every room
+wheel = TimerWheel()
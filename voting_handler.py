@@ -80,7 +80,7 @@ class VotingHandler:
                     # Handle bot voting
                     vote = await self.ai_handler.get_vote(player, room.get_alive_players())
                     if vote:
-                        room.votes[player["id"]] = vote
+                        room.cast_vote(player["id"], vote)
                 else:
                     # Send voting prompt to real players
                     await self.send_voting_prompt(player, room, context)
@@ -124,7 +124,7 @@ class VotingHandler:
 
         # Find player with most votes
         most_voted_id = max(vote_counts.items(), key=lambda x: x[1])[0]
-        most_voted_player = next(p for p in room.players if p["id"] == most_voted_id)
+        most_voted_player = room.players.get(most_voted_id)
 
         # Announce result
         await context.bot.send_message(
@@ -133,4 +133,4 @@ class VotingHandler:
         )
 
         # Update player state
-        most_voted_player["is_alive"] = False
+        room.kill_player(most_voted_player)
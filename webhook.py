@@ -0,0 +1,197 @@
+"""
+Webhook Update Ingestion
+Created by @berlinnad
+Copyright (c) 2024 Berlinnad. All rights reserved.
+"""
+
+import asyncio
+import hmac
+import ipaddress
+import logging
+import ssl
+import subprocess
+from typing import Optional
+from aiohttp import web
+from telegram import Update
+
+# Header Telegram sends with the secret_token given to setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def self_signed_cert(host: str, cert_path: str, key_path: str, days: int = 365):
+    """Write a self-signed certificate for ``host`` (needs the openssl CLI).
+
+    Telegram accepts it when the same file is uploaded with setWebhook,
+    which WebhookServer does for any cert it serves with.
+    """
+    try:
+        ipaddress.ip_address(host)
+        alt_name = f"IP:{host}"
+    except ValueError:
+        alt_name = f"DNS:{host}"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-sha256",
+         "-days", str(days), "-keyout", key_path, "-out", cert_path,
+         "-subj", f"/CN={host}", "-addext", f"subjectAltName={alt_name}"],
+        check=True, capture_output=True
+    )
+
+
+class WebhookServer:
+    """Receives updates from Telegram on an aiohttp server.
+
+    POST ``path`` checks the secret token, parses the update and puts it
+    on the Application's update_queue, then answers 200 straight away;
+    handlers run later. When ``max_pending`` updates are already queued or
+    being handled it answers 503 instead, and Telegram delivers the update again later.
+    GET /healthz reports whether updates are being accepted.
+
+    With ``url``, start() registers the webhook with Telegram (uploading
+    the certificate if there is one); without it the server only takes
+    what is posted to it, e.g. by fake_updates.py.
+    """
+
+    def __init__(self, application, secret_token: str, path: str = "/telegram",
+                 listen: str = "0.0.0.0", port: int = 8443, max_pending: int = 1000,
+                 cert: Optional[str] = None, key: Optional[str] = None, url: Optional[str] = None):
+        if not secret_token:
+            raise ValueError("A webhook needs a secret token")
+        self.application = application
+        self.secret_token = secret_token
+        self.path = path
+        self.listen = listen
+        self.port = port
+        self.max_pending = max_pending
+        self.cert = cert
+        self.key = key
+        self.url = url
+        self._runner = None
+        self.accepted = 0
+        self.rejected = 0
+        self.unauthorized = 0
+        self.invalid = 0
+
+    @property
+    def pending(self) -> int:
+        """Updates accepted and not yet fully processed.
+
+        With concurrent_updates the Application takes each update off the
+        queue right away, so qsize() stays near 0; it calls task_done()
+        only once the update's handlers have finished.
+        """
+        queue = self.application.update_queue
+        return getattr(queue, "_unfinished_tasks", queue.qsize())
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            self.unauthorized += 1
+            return web.Response(status=403)
+
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            self.invalid += 1
+            logging.warning(f"Invalid webhook update: {e}")
+            return web.Response(status=400)
+        if update is None:
+            self.invalid += 1
+            return web.Response(status=400)
+
+        self.application.update_queue.put_nowait(update)
+        self.accepted += 1
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        ok = self.pending < self.max_pending
+        return web.json_response({
+            "status": "ok" if ok else "busy",
+            "pending": self.pending,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "unauthorized": self.unauthorized,
+            "invalid": self.invalid,
+        }, status=200 if ok else 503)
+
+    def ssl_context(self) -> Optional[ssl.SSLContext]:
+        if not self.cert:
+            return None
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(self.cert, self.key)
+        return context
+
+    async def register(self):
+        certificate = open(self.cert, "rb") if self.cert else None
+        try:
+            await self.application.bot.set_webhook(
+                self.url,
+                certificate=certificate,
+                secret_token=self.secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=False
+            )
+        finally:
+            if certificate:
+                certificate.close()
+
+    async def start(self):
+        if self.url:
+            await self.register()
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port, ssl_context=self.ssl_context())
+        await site.start()
+        logging.info(f"Webhook listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def run_application(application, stop: asyncio.Event, sources=()):
+    """Run ``application`` on updates from ``sources`` until ``stop`` is set.
+
+    Does what Application.run_polling does around the update source:
+    initialize, post_init, start; and stop, post_stop, shutdown,
+    post_shutdown at the end. A source has async start() and stop() and
+    puts updates on application.update_queue (WebhookServer, sharding's
+    worker pipe).
+    """
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    started = []
+    try:
+        for source in sources:
+            await source.start()
+            started.append(source)
+        await application.start()
+        await stop.wait()
+    finally:
+        for source in started:
+            await source.stop()
+        try:
+            if application.running:
+                await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.shutdown()
+        finally:
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+
+async def run_webhook(application, server: WebhookServer, stop: asyncio.Event):
+    """Run ``application`` on updates from ``server`` until ``stop`` is set"""
+    await run_application(application, stop, [server])